@@ -1,20 +1,100 @@
 import json
+import os
+import time
 
 import stockfish
 from _version import __version__
 
 DEPTH = 20
+STOCKFISH_PATH = os.environ.get(
+    'STOCKFISH_PATH',
+    '/home/app/function/package/stockfish_executable',
+)
 STOCKFISH_VERSION = 13
+# each position takes a while at this depth, so keep batches well within
+# the function timeout
+MAX_BATCH_SIZE = 100
 
+# kept between invocations on a warm container, so that only the first
+# request on each container pays for starting the engine
+_engine: stockfish.Stockfish | None = None
 
-def handle(event, context):
-    sf = stockfish.Stockfish('/home/app/function/package/stockfish_executable',
-                             depth=DEPTH)
-    body = json.loads(event['body'])
-    fen = body['fen']
+
+def _get_engine(timings: dict[str, float]) -> stockfish.Stockfish:
+    """
+    Get the warm engine, starting a new one if there is none or it died.
+    """
+    global _engine
+
+    if _engine is not None and _engine.stockfish.poll() is None:
+        return _engine
+
+    start = time.perf_counter()
+    _engine = stockfish.Stockfish(STOCKFISH_PATH, depth=DEPTH)
+    timings['engine_start_time'] += time.perf_counter() - start
+    return _engine
+
+
+def _search(sf: stockfish.Stockfish,
+            fen: str,
+            timings: dict[str, float],
+            ) -> str:
+    start = time.perf_counter()
+    # positions without a best move leave the info untouched, so don't
+    # return the one of the previous search
+    sf.info = ''
+    # setting the position starts a new game, so the previous searches
+    # don't affect this one
     sf.set_fen_position(fen)
     sf.get_best_move()
-    body['result'] = sf.info
+    timings['search_time'] += time.perf_counter() - start
+    return sf.info
+
+
+def _evaluate(fen: str, timings: dict[str, float]) -> str:
+    global _engine
+
+    sf = _get_engine(timings)
+    try:
+        return _search(sf, fen, timings)
+    except OSError:
+        # the engine died since the health check, so retry on a new one
+        sf.stockfish.kill()
+        _engine = None
+        return _search(_get_engine(timings), fen, timings)
+
+
+def _error(message: str) -> dict:
+    return {
+        'body': json.dumps({'error': message}),
+        'statusCode': 400,
+    }
+
+
+def handle(event, context):
+    """
+    Evaluate positions with stockfish.
+
+    The body has either a single `fen`, answered with its engine output as
+    `result`, or a list of `fens`, answered with a list of `results` in the
+    same order. Every position is evaluated by the same warm engine, and
+    the response has the seconds spent starting it and searching.
+    """
+    body = json.loads(event['body'])
+
+    if 'fens' in body:
+        fens = body['fens']
+        if not isinstance(fens, list):
+            return _error('fens must be a list')
+        if len(fens) > MAX_BATCH_SIZE:
+            return _error(f'At most {MAX_BATCH_SIZE} fens per request')
+
+    timings: dict[str, float] = {'engine_start_time': 0, 'search_time': 0}
+    if 'fens' in body:
+        body['results'] = [_evaluate(fen, timings) for fen in body['fens']]
+    else:
+        body['result'] = _evaluate(body['fen'], timings)
+    body.update(timings)
     body['depth'] = DEPTH
     body['cloud_function_version'] = __version__
     body['stockfish_version'] = STOCKFISH_VERSION
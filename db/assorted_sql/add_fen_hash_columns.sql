@@ -0,0 +1,28 @@
+-- the hashes have to be computed in python, so this is done in two steps:
+-- 1. add the (nullable) columns and export the fens with
+--    \copy (select distinct fen from game_positions union select fen from position_evals)
+--    to '/path/to/fens.csv' with csv;
+-- 2. run scripts/hash_fens.py /path/to/fens.csv /path/to/fen_hashes.csv
+--    and run the second transaction below to backfill the hashes
+begin;
+alter table position_evals add column fen_hash bigint;
+alter table game_positions add column fen_hash bigint;
+commit;
+
+begin;
+create temp table fen_hashes(fen text primary key, fen_hash bigint not null);
+\copy fen_hashes from '/path/to/fen_hashes.csv' with csv;
+
+update position_evals set fen_hash = fen_hashes.fen_hash
+from fen_hashes where fen_hashes.fen = position_evals.fen;
+update game_positions set fen_hash = fen_hashes.fen_hash
+from fen_hashes where fen_hashes.fen = game_positions.fen;
+
+alter table position_evals alter column fen_hash set not null;
+alter table game_positions alter column fen_hash set not null;
+create index position_evals_fen_hash_idx on position_evals (fen_hash);
+create index game_positions_fen_hash_idx on game_positions (fen_hash);
+
+drop view game_evals;
+\i /sql_scripts/tables/game_evals_view.sql
+commit;
@@ -0,0 +1,12 @@
+begin;
+-- keep only the latest evaluation for each position
+delete from position_evals where id in (
+    select id from (
+        select id,
+               row_number() over (partition by fen order by id desc) as rn
+        from position_evals
+    ) ranked
+    where rn > 1
+);
+create unique index position_evals_fen_idx on position_evals (fen);
+commit;
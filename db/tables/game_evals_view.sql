@@ -6,6 +6,9 @@ create view game_evals as
            eval_depth,
            probability_lr      as win_probability_lr
     from game_positions
-    inner join position_evals                on position_evals.fen = game_positions.fen
+    -- the hash is indexed and narrow; the fen check guards against
+    -- positions that share a hash but differ in their halfmove clock
+    inner join position_evals                on position_evals.fen_hash = game_positions.fen_hash
+                                            and position_evals.fen = game_positions.fen
     inner join win_probabilities_eval_only   on win_probabilities_eval_only.eval = position_evals.evaluation
 ;
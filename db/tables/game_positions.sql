@@ -3,5 +3,9 @@ id            serial   primary key,
 game_link     text     not null,
 -- we don't need 4 bytes so we may as well save space and use smallint
 half_move     smallint not null,
-fen           text     not null
+fen           text     not null,
+-- 64-bit zobrist hash of the position, much cheaper to join on than fen
+fen_hash      bigint   not null
 );
+
+create index game_positions_fen_hash_idx on game_positions (fen_hash);
@@ -1,6 +1,12 @@
 create table position_evals(
 id            serial   primary key,
 fen           text     not null,
+-- 64-bit zobrist hash of the position, much cheaper to join on than fen
+fen_hash      bigint   not null,
 evaluation    real     not null,
 eval_depth    smallint not null
 );
+
+-- both the eval lookups and the upserts filter on fen
+create unique index position_evals_fen_idx on position_evals (fen);
+create index position_evals_fen_hash_idx on position_evals (fen_hash);
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import timeit
+
+import adbc_driver_postgresql.dbapi
+import pyarrow as pa
+from pipeline_import.configs import get_cfg
+from vendors.stockfish import DB_LOOKUP_STRATEGIES, get_db_evaluations
+
+# the stored evals are marked so they can't clash with real positions, and
+# are deleted again once the benchmark is done
+FEN_PREFIX = 'db lookup benchmark'
+STORED_POSITIONS = 200_000
+POSITION_COUNTS = [1_000, 5_000, 10_000, 20_000, 50_000, 100_000]
+
+
+def get_db_uri():
+    pg_cfg = get_cfg('postgres_cfg')
+    return 'postgresql://{}:{}@{}:{}/{}'.format(pg_cfg['user'],
+                                                pg_cfg['password'],
+                                                pg_cfg['host'],
+                                                pg_cfg['port'],
+                                                pg_cfg['database'],
+                                                )
+
+
+def run_db_statements(sql, table=None):
+    with adbc_driver_postgresql.dbapi.connect(get_db_uri()) as conn:
+        with conn.cursor() as cur:
+            if table is not None:
+                cur.adbc_ingest('temp_benchmark_positions',
+                                table,
+                                mode='create',
+                                temporary=True,
+                                )
+            cur.execute(sql)
+        conn.commit()
+
+
+def store_positions():
+    fens = [f'{FEN_PREFIX} {idx}' for idx in range(STORED_POSITIONS)]
+    run_db_statements("""
+        insert into position_evals (fen, fen_hash, evaluation, eval_depth)
+        select fen, 0, 0, 20 from temp_benchmark_positions
+    """, table=pa.table({'fen': fens}))
+
+
+def delete_positions():
+    run_db_statements(f"""
+        delete from position_evals where fen like '{FEN_PREFIX} %'
+    """)
+
+
+def run_benchmark():
+    times = {}
+
+    for position_count in POSITION_COUNTS:
+        # every other position is in the db, the rest are misses
+        positions = [f'{FEN_PREFIX} {idx * 2}'
+                     if idx % 2 else f'{FEN_PREFIX} missing {idx}'
+                     for idx in range(position_count)]
+
+        for strategy in DB_LOOKUP_STRATEGIES:
+            with contextlib.redirect_stdout(io.StringIO()):
+                time_taken = min(timeit.repeat(
+                    lambda: get_db_evaluations(positions, strategy=strategy),
+                    repeat=3,
+                    number=1,
+                ))
+
+            print(f'{position_count} positions :: {strategy} :: '
+                  f'{time_taken:.3f}s')
+
+            times[position_count, strategy] = time_taken
+
+    return times
+
+
+if __name__ == '__main__':
+    # run from the repo root with PYTHONPATH=src, against a scratch database
+    # that has the position_evals table from db/tables/position_evals.sql.
+    # the db is picked with the postgres_cfg section of the config, e.g.
+    # CHESS_PIPELINE__POSTGRES_CFG__HOST=localhost
+
+    print(f'Storing {STORED_POSITIONS} positions...')
+    store_positions()
+
+    try:
+        print('Running benchmark...')
+        run_benchmark()
+    finally:
+        delete_positions()
+
+    print('Benchmark finished')
@@ -0,0 +1,36 @@
+#! /usr/bin/env python3
+
+import csv
+
+import chess
+import chess.polyglot
+
+# this mirrors pipeline_import.transforms.get_position_hashes, which stores
+# the unsigned zobrist hash as a signed postgres bigint
+
+
+def hash_fen(fen):
+    fen_hash = chess.polyglot.zobrist_hash(chess.Board(fen))
+    if fen_hash >= 2 ** 63:
+        fen_hash -= 2 ** 64
+    return fen_hash
+
+
+if __name__ == '__main__':
+    import sys
+
+    # get data from psql with:
+    # \copy (select distinct fen from game_positions
+    #        union select fen from position_evals)
+    # to '/path/to/fens.csv' with csv;
+
+    if len(sys.argv) < 3:
+        raise ValueError('Not enough arguments: requires input csv location '
+                         'and output csv location')
+    _, input_location, output_location = sys.argv
+
+    with open(input_location, 'r') as f_in:
+        with open(output_location, 'w') as f_out:
+            writer = csv.writer(f_out)
+            for (fen,) in csv.reader(f_in):
+                writer.writerow([fen, hash_fen(fen)])
@@ -1,29 +1,19 @@
 import argparse
+import importlib
 import os
-from datetime import date, datetime
-from pathlib import Path
-from typing import Protocol
-
-from feature_engineering import (
-    clean_chess_df,
-    explode_clocks,
-    explode_materials,
-    explode_moves,
-    explode_positions,
-)
-from inference import estimate_win_probabilities
-from pipeline_import.postgres_templates import (
-    load_chess_games,
-    load_game_materials,
-    load_game_positions,
-    load_move_clocks,
-    load_move_list,
-    load_position_evals,
-    load_win_probs,
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
 )
-from pipeline_import.transforms import transform_game_data
-from vendors.lichess import fetch_lichess_api_json, fetch_lichess_api_pgn
-from vendors.stockfish import get_evals
+from contextlib import AbstractContextManager, nullcontext
+from datetime import date, datetime, timedelta
+from graphlib import TopologicalSorter
+from itertools import product
+from pathlib import Path
+from typing import Any, Protocol
 
 
 class EtlStep(Protocol):
@@ -43,70 +33,365 @@ class EtlStep(Protocol):
         ...
 
 
-ETL_STEPS: dict[str, EtlStep] = {'fetch_json': fetch_lichess_api_json,
-                                 'fetch_pgn': fetch_lichess_api_pgn,
-                                 'clean_df': clean_chess_df,
-                                 'get_evals': get_evals,
-                                 'explode_moves': explode_moves,
-                                 'explode_clocks': explode_clocks,
-                                 'explode_positions': explode_positions,
-                                 'explode_materials': explode_materials,
-                                 'get_game_infos': transform_game_data,
-                                 'get_win_probs': estimate_win_probabilities,
-                                 'load_chess_games': load_chess_games,
-                                 'load_position_evals': load_position_evals,
-                                 'load_game_positions': load_game_positions,
-                                 'load_game_materials': load_game_materials,
-                                 'load_move_clocks': load_move_clocks,
-                                 'load_move_list': load_move_list,
-                                 'load_win_probs': load_win_probs,
-                                 }
+# steps are imported by path when they run, so that running a single step
+# doesn't import the dependencies of all the others
+ETL_STEPS: dict[str, str] = {
+    'fetch_json': 'vendors.lichess.fetch_lichess_api_json',
+    'fetch_pgn': 'vendors.lichess.fetch_lichess_api_pgn',
+    'clean_df': 'feature_engineering.clean_chess_df',
+    'get_evals': 'vendors.stockfish.get_evals',
+    'explode_moves': 'feature_engineering.explode_moves',
+    'explode_clocks': 'feature_engineering.explode_clocks',
+    'explode_positions': 'feature_engineering.explode_positions',
+    'explode_materials': 'feature_engineering.explode_materials',
+    'explode_all': 'feature_engineering.explode_all',
+    'get_game_infos': 'pipeline_import.transforms.transform_game_data',
+    'get_win_probs': 'inference.estimate_win_probabilities',
+    'load_chess_games': 'pipeline_import.postgres_templates.load_chess_games',
+    'load_position_evals':
+        'pipeline_import.postgres_templates.load_position_evals',
+    'load_game_positions':
+        'pipeline_import.postgres_templates.load_game_positions',
+    'load_game_materials':
+        'pipeline_import.postgres_templates.load_game_materials',
+    'load_move_clocks': 'pipeline_import.postgres_templates.load_move_clocks',
+    'load_move_list': 'pipeline_import.postgres_templates.load_move_list',
+    'load_win_probs': 'pipeline_import.postgres_templates.load_win_probs',
+}
+
+
+def load_step(step: str) -> EtlStep:
+    """
+    Import the function implementing `step`.
+    """
+    module_name, _, function_name = ETL_STEPS[step].rpartition('.')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+# files each step reads and writes in the io dir, named without the prefix.
+# the dependencies between steps follow from them
+STEP_INPUTS: dict[str, set[str]] = {
+    'fetch_json': set(),
+    'fetch_pgn': {'raw_json'},
+    'clean_df': {'raw_json', 'raw_pgn'},
+    'get_evals': {'cleaned_df'},
+    'explode_moves': {'cleaned_df'},
+    'explode_clocks': {'cleaned_df'},
+    'explode_positions': {'cleaned_df'},
+    'explode_materials': {'cleaned_df'},
+    'explode_all': {'cleaned_df'},
+    'get_game_infos': {'cleaned_df'},
+    'get_win_probs': {'game_infos',
+                      'evals',
+                      'exploded_positions',
+                      'exploded_clocks',
+                      },
+    'load_chess_games': {'game_infos'},
+    'load_position_evals': {'evals'},
+    'load_game_positions': {'exploded_positions'},
+    'load_game_materials': {'exploded_materials'},
+    'load_move_clocks': {'exploded_clocks'},
+    'load_move_list': {'exploded_moves'},
+    'load_win_probs': {'win_probabilities'},
+}
+STEP_OUTPUTS: dict[str, set[str]] = {
+    'fetch_json': {'raw_json'},
+    'fetch_pgn': {'raw_pgn'},
+    'clean_df': {'cleaned_df'},
+    'get_evals': {'evals'},
+    'explode_moves': {'exploded_moves'},
+    'explode_clocks': {'exploded_clocks'},
+    'explode_positions': {'exploded_positions'},
+    'explode_materials': {'exploded_materials'},
+    'explode_all': {'exploded_moves',
+                    'exploded_clocks',
+                    'exploded_positions',
+                    'exploded_materials',
+                    },
+    'get_game_infos': {'game_infos'},
+    'get_win_probs': {'win_probabilities'},
+    'load_chess_games': set(),
+    'load_position_evals': set(),
+    'load_game_positions': set(),
+    'load_game_materials': set(),
+    'load_move_clocks': set(),
+    'load_move_list': set(),
+    'load_win_probs': set(),
+}
+
+# steps to run for each player-day when `--step all` is passed, in order
+ALL_STEPS: list[str] = ['fetch_json',
+                        'fetch_pgn',
+                        'clean_df',
+                        'get_evals',
+                        'explode_all',
+                        'get_game_infos',
+                        'get_win_probs',
+                        'load_chess_games',
+                        'load_position_evals',
+                        'load_game_positions',
+                        'load_game_materials',
+                        'load_move_clocks',
+                        'load_move_list',
+                        'load_win_probs',
+                        ]
+
+
+def get_step_graph(steps: list[str]) -> dict[str, set[str]]:
+    """
+    Map each of `steps` to the steps among them that write its inputs.
+
+    Inputs that no step in `steps` writes are expected to already be in the
+    io dir.
+    """
+    return {step: {other
+                   for other in steps
+                   if other != step
+                   and STEP_OUTPUTS[other] & STEP_INPUTS[step]}
+            for step in steps}
+
+
+def order_steps(steps: list[str]) -> list[str]:
+    """
+    Sort `steps` so that every step runs after the steps it depends on.
+    """
+    return list(TopologicalSorter(get_step_graph(steps)).static_order())
+
+
+def get_data_dates(start_date: date, end_date: date | None) -> list[date]:
+    """
+    Get every date from `start_date` to `end_date`, both included.
+    """
+    if end_date is None:
+        return [start_date]
+    if end_date < start_date:
+        raise ValueError(f'End date {end_date} is before start date '
+                         f'{start_date}')
+    return [start_date + timedelta(days=offset)
+            for offset in range((end_date - start_date).days + 1)]
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='ETL for lichess data')
     parser.add_argument('--player',
                         type=str,
-                        default='thibault',
-                        help='Lichess username for the player whose data will '
-                             'be downloaded.',
+                        nargs='+',
+                        default=['thibault'],
+                        help='Lichess usernames for the players whose data '
+                             'will be downloaded.',
                         )
     parser.add_argument('--perf_type',
                         type=str,
-                        default='bullet',
+                        nargs='+',
+                        default=['bullet'],
                         choices=['ultrabullet',
                                  'bullet',
                                  'blitz',
                                  'rapid',
                                  'classical',
                                  ],
-                        help='Perf type to download player data for.',
+                        help='Perf types to download player data for.',
                         )
     parser.add_argument('--data_date',
                         type=date.fromisoformat,
                         default=datetime(2024, 1, 29),
                         help='Date to download data for. Works in GMT.',
                         )
+    parser.add_argument('--end_date',
+                        type=date.fromisoformat,
+                        default=None,
+                        help='If passed, download data for every date from '
+                             '--data_date up to and including this one.',
+                        )
     parser.add_argument('--local_stockfish',
                         action='store_true',
                         help='Whether to use stockfish locally to calculate '
                              'position evaluations.',
                         )
+    parser.add_argument('--eval_workers',
+                        type=int,
+                        default=1,
+                        help='How many positions to evaluate concurrently '
+                             'in the get_evals step.',
+                        )
+    parser.add_argument('--max_parallel',
+                        type=int,
+                        default=1,
+                        help='How many independent steps to run at the same '
+                             'time, each in its own process.',
+                        )
+    parser.add_argument('--in_memory',
+                        action='store_true',
+                        help='Pass outputs between steps in memory instead '
+                             'of writing them to parquet files.',
+                        )
+    parser.add_argument('--checkpoint',
+                        type=str,
+                        nargs='*',
+                        default=[],
+                        choices=sorted(set().union(*STEP_OUTPUTS.values())),
+                        help='Outputs to still write to disk when running '
+                             'with --in_memory.',
+                        )
     parser.add_argument('--step',
                         type=str,
-                        choices=ETL_STEPS.keys(),
+                        nargs='+',
+                        choices=[*ETL_STEPS, 'all'],
                         required=True,
-                        help='Which ETL step to run.',
+                        help='Which ETL steps to run. They run in '
+                             'dependency order, whatever order they are '
+                             'given in. `all` runs the whole pipeline.',
                         )
     return parser.parse_args()
 
 
+def _run_step(step: str,
+              player: str,
+              perf_type: str,
+              data_date: date,
+              local_stockfish: bool,
+              io_dir: Path,
+              **kwargs: Any,
+              ) -> None:
+    print(f'Running {step} for {player=} {perf_type=} {data_date=}')
+    load_step(step)(player=player,
+                    perf_type=perf_type,
+                    data_date=data_date,
+                    local_stockfish=local_stockfish,
+                    io_dir=io_dir,
+                    **kwargs,
+                    )
+
+
+def run_steps_concurrently(executor: Executor,
+                           steps: list[str],
+                           step_kwargs: dict[str, dict[str, Any]],
+                           **run_kwargs: Any,
+                           ) -> None:
+    """
+    Run `steps` on `executor`, starting each one as soon as its dependencies
+    are done.
+
+    `run_kwargs` are passed to every step, `step_kwargs` only to the step
+    they're keyed by. The first failing step's exception is raised once the
+    steps already running have finished.
+    """
+    sorter = TopologicalSorter(get_step_graph(steps))
+    sorter.prepare()
+
+    running: dict[Future, str] = {}
+    while sorter.is_active():
+        for step in sorter.get_ready():
+            future = executor.submit(_run_step,
+                                     step,
+                                     **run_kwargs,
+                                     **step_kwargs.get(step, {}),
+                                     )
+            running[future] = step
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            step = running.pop(future)
+            future.result()
+            sorter.done(step)
+
+
+def run_steps(steps: list[str],
+              players: list[str],
+              perf_types: list[str],
+              data_dates: list[date],
+              local_stockfish: bool,
+              io_dir: Path,
+              eval_workers: int = 1,
+              in_memory: bool = False,
+              checkpoints: list[str] | None = None,
+              max_parallel: int = 1,
+              ) -> None:
+    """
+    Run `steps` for every date, player and perf type.
+
+    Steps run in dependency order. Stockfish engines, the win probability
+    model and database engines are only set up once and reused across all
+    the runs. With `in_memory`, steps hand their outputs to each other
+    without going through parquet files, except for the `checkpoints`.
+
+    With `max_parallel` above 1, independent steps of each run execute
+    concurrently in a pool of that many processes. Outputs then have to go
+    through the io dir, and each get_evals run starts its own engines.
+    """
+    if max_parallel < 1:
+        raise ValueError('max_parallel must be at least 1, got '
+                         f'{max_parallel}')
+    if in_memory and max_parallel > 1:
+        raise ValueError('Outputs can only be kept in memory when running '
+                         'steps one at a time')
+
+    steps = order_steps(steps)
+
+    # share the engines between all the runs, they are only started when
+    # the first position needs evaluating. they can't be sent to other
+    # processes though
+    sf_pool = None
+    pool_context: AbstractContextManager = nullcontext()
+    if local_stockfish and 'get_evals' in steps and max_parallel == 1:
+        from vendors.stockfish import get_stockfish_pool
+
+        sf_pool = get_stockfish_pool(eval_workers)
+        pool_context = sf_pool
+
+    # options that only apply to a single step
+    step_kwargs: dict[str, dict[str, Any]] = {
+        'get_evals': {'eval_workers': eval_workers},
+    }
+    if sf_pool is not None:
+        step_kwargs['get_evals']['sf_pool'] = sf_pool
+
+    executor_context: AbstractContextManager = nullcontext()
+    if max_parallel > 1:
+        executor_context = ProcessPoolExecutor(max_workers=max_parallel)
+
+    with pool_context, executor_context as executor:
+        for data_date, player, perf_type in product(data_dates,
+                                                    players,
+                                                    perf_types,
+                                                    ):
+            run_kwargs: dict[str, Any] = {'player': player,
+                                          'perf_type': perf_type,
+                                          'data_date': data_date,
+                                          'local_stockfish': local_stockfish,
+                                          'io_dir': io_dir,
+                                          }
+            if executor is not None:
+                run_steps_concurrently(executor,
+                                       steps,
+                                       step_kwargs,
+                                       **run_kwargs,
+                                       )
+                continue
+
+            # outputs are only kept in memory for a single player-day
+            outputs_context: AbstractContextManager = nullcontext()
+            if in_memory:
+                from utils.output import keep_outputs_in_memory
+
+                outputs_context = keep_outputs_in_memory(checkpoints or [])
+
+            with outputs_context:
+                for step in steps:
+                    _run_step(step, **run_kwargs, **step_kwargs.get(step, {}))
+
+
 if __name__ == '__main__':
     args = parse_args()
 
-    df = ETL_STEPS[args.step](player=args.player,
-                              perf_type=args.perf_type,
-                              data_date=args.data_date,
-                              local_stockfish=args.local_stockfish,
-                              io_dir=Path(os.environ['DAGSTER_IO_DIR']),
-                              )
+    run_steps(steps=ALL_STEPS if 'all' in args.step else args.step,
+              players=args.player,
+              perf_types=args.perf_type,
+              data_dates=get_data_dates(args.data_date, args.end_date),
+              local_stockfish=args.local_stockfish,
+              io_dir=Path(os.environ['DAGSTER_IO_DIR']),
+              eval_workers=args.eval_workers,
+              in_memory=args.in_memory,
+              checkpoints=args.checkpoint,
+              max_parallel=args.max_parallel,
+              )
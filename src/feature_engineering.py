@@ -1,13 +1,35 @@
 from datetime import date
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from pipeline_import.transforms import (
     convert_clock_to_seconds,
     fix_provisional_columns,
     get_clean_fens,
+    get_exploded_lengths,
+    get_half_moves,
+    get_half_moves_from_lengths,
+    get_position_hashes,
 )
-from utils.output import get_output_file_prefix
+from pipeline_import.visitors import MATERIAL_PIECES
+from utils.output import (
+    get_output_file_prefix,
+    read_step_input,
+    write_step_output,
+)
+
+MATERIAL_COLUMNS: dict[str, str] = {'P': 'pawns_white',
+                                    'N': 'knights_white',
+                                    'B': 'bishops_white',
+                                    'R': 'rooks_white',
+                                    'Q': 'queens_white',
+                                    'p': 'pawns_black',
+                                    'n': 'knights_black',
+                                    'b': 'bishops_black',
+                                    'r': 'rooks_black',
+                                    'q': 'queens_black',
+                                    }
 
 
 def clean_chess_df(player: str,
@@ -20,11 +42,18 @@ def clean_chess_df(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    json = pd.read_parquet(io_dir / f'{prefix}_raw_json.parquet')
-    pgn = pd.read_parquet(io_dir / f'{prefix}_raw_pgn.parquet')
+    json = read_step_input(io_dir / f'{prefix}_raw_json.parquet',
+                           columns=['id',
+                                    'speed',
+                                    'status',
+                                    'players_black_provisional',
+                                    'players_white_provisional',
+                                    ],
+                           )
+    pgn = read_step_input(io_dir / f'{prefix}_raw_pgn.parquet')
 
     if pgn.empty and json.empty:
-        pgn.to_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+        write_step_output(pgn, io_dir / f'{prefix}_cleaned_df.parquet')
         return
     elif pgn.empty or json.empty:
         raise ValueError('Found only one of pgn/json empty for input '
@@ -67,7 +96,65 @@ def clean_chess_df(player: str,
                        'players_white_provisional': 'white_elo_tentative',
                        },
               inplace=True)
-    df.to_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    write_step_output(df, io_dir / f'{prefix}_cleaned_df.parquet')
+
+
+EXPLODED_COLUMNS: dict[str, str] = {'moves': 'move',
+                                    'clocks': 'clock',
+                                    'positions': 'position',
+                                    'material_by_move': 'material_by_move',
+                                    }
+
+
+def _explode(df: pd.DataFrame,
+             column: str,
+             half_moves: np.ndarray | None = None,
+             ) -> pd.DataFrame:
+    if half_moves is None:
+        half_moves = get_half_moves(df[column])
+    df = df[['game_link', column]]
+    # the game link is repeated on every half move, so store it as a
+    # dictionary-encoded column. it is decoded back to text when loading
+    df = df.assign(game_link=df['game_link'].astype('category'))
+    df = df.explode(column)
+    df.rename(columns={column: EXPLODED_COLUMNS[column]},
+              inplace=True)
+    df['half_move'] = half_moves
+    return df
+
+
+def _explode_moves(df: pd.DataFrame,
+                   half_moves: np.ndarray | None = None,
+                   ) -> pd.DataFrame:
+    return _explode(df, 'moves', half_moves)
+
+
+def _explode_clocks(df: pd.DataFrame,
+                    half_moves: np.ndarray | None = None,
+                    ) -> pd.DataFrame:
+    df = _explode(df, 'clocks', half_moves)
+    df['clock'] = convert_clock_to_seconds(df['clock'])
+    return df
+
+
+def _explode_positions(df: pd.DataFrame,
+                       half_moves: np.ndarray | None = None,
+                       ) -> pd.DataFrame:
+    df = _explode(df, 'positions', half_moves)
+    df['fen'] = get_clean_fens(df['position'])
+    df['fen_hash'] = get_position_hashes(df['fen'])
+    return df
+
+
+def _explode_materials(df: pd.DataFrame,
+                       half_moves: np.ndarray | None = None,
+                       ) -> pd.DataFrame:
+    df = _explode(df, 'material_by_move', half_moves)
+    return pd.concat([df['game_link'],
+                      get_material_counts(df['material_by_move']),
+                      df['half_move'],
+                      ],
+                     axis=1)
 
 
 def explode_moves(player: str,
@@ -80,17 +167,15 @@ def explode_moves(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['game_link', 'moves'],
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_exploded_moves.parquet')
+        write_step_output(df, io_dir / f'{prefix}_exploded_moves.parquet')
         return
-    df = df[['game_link', 'moves']]
 
-    df = df.explode('moves')
-    df.rename(columns={'moves': 'move'},
-              inplace=True)
-    df['half_move'] = df.groupby('game_link').cumcount() + 1
-    df.to_parquet(io_dir / f'{prefix}_exploded_moves.parquet')
+    df = _explode_moves(df)
+    write_step_output(df, io_dir / f'{prefix}_exploded_moves.parquet')
 
 
 def explode_clocks(player: str,
@@ -103,18 +188,15 @@ def explode_clocks(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['game_link', 'clocks'],
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_exploded_clocks.parquet')
+        write_step_output(df, io_dir / f'{prefix}_exploded_clocks.parquet')
         return
-    df = df[['game_link', 'clocks']]
 
-    df = df.explode('clocks')
-    df.rename(columns={'clocks': 'clock'},
-              inplace=True)
-    df['half_move'] = df.groupby('game_link').cumcount() + 1
-    df['clock'] = convert_clock_to_seconds(df['clock'])
-    df.to_parquet(io_dir / f'{prefix}_exploded_clocks.parquet')
+    df = _explode_clocks(df)
+    write_step_output(df, io_dir / f'{prefix}_exploded_clocks.parquet')
 
 
 def explode_positions(player: str,
@@ -127,19 +209,43 @@ def explode_positions(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['game_link', 'positions'],
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_exploded_positions.parquet')
+        write_step_output(df, io_dir / f'{prefix}_exploded_positions.parquet')
         return
-    df = df[['game_link', 'positions']]
 
-    df = df.explode('positions')
-    df.rename(columns={'positions': 'position'},
-              inplace=True)
-    df['half_move'] = df.groupby('game_link').cumcount() + 1
+    df = _explode_positions(df)
+    write_step_output(df, io_dir / f'{prefix}_exploded_positions.parquet')
 
-    df['fen'] = get_clean_fens(df['position'])
-    df.to_parquet(io_dir / f'{prefix}_exploded_positions.parquet')
+
+def get_material_counts(materials: pd.Series) -> pd.DataFrame:
+    """
+    Turn exploded `material_by_move` entries into one int8 column per piece.
+
+    Entries are fixed-width arrays of counts in `MATERIAL_PIECES` order.
+    Files cleaned before that format was introduced hold dicts keyed by
+    piece symbol instead, which are converted without going through a
+    Series per row.
+    """
+    columns: list[str] = [MATERIAL_COLUMNS[piece] for piece in MATERIAL_PIECES]
+    if materials.empty:
+        return pd.DataFrame([], columns=columns, index=materials.index,
+                            dtype=np.int8)
+
+    values = materials.to_numpy()
+    if isinstance(values[0], dict):
+        counts = (pd.DataFrame.from_records(values, columns=MATERIAL_PIECES)
+                    .fillna(0)
+                    .to_numpy())
+    else:
+        counts = np.stack(values)
+
+    return pd.DataFrame(counts.astype(np.int8),
+                        columns=columns,
+                        index=materials.index,
+                        )
 
 
 def explode_materials(player: str,
@@ -152,31 +258,63 @@ def explode_materials(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['game_link', 'material_by_move'],
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_exploded_materials.parquet')
+        write_step_output(df, io_dir / f'{prefix}_exploded_materials.parquet')
         return
-    df = df[['game_link', 'material_by_move']]
-
-    df = df.explode('material_by_move')
-
-    df = pd.concat([df['game_link'],
-                    df['material_by_move'].apply(pd.Series)
-                                          .fillna(0)
-                                          .astype(int)],
-                   axis=1)
-    df.rename(columns={'r': 'rooks_black',
-                       'n': 'knights_black',
-                       'b': 'bishops_black',
-                       'q': 'queens_black',
-                       'p': 'pawns_black',
-                       'P': 'pawns_white',
-                       'R': 'rooks_white',
-                       'N': 'knights_white',
-                       'B': 'bishops_white',
-                       'Q': 'queens_white',
-                       },
-              inplace=True)
 
-    df['half_move'] = df.groupby('game_link').cumcount() + 1
-    df.to_parquet(io_dir / f'{prefix}_exploded_materials.parquet')
+    df = _explode_materials(df)
+    write_step_output(df, io_dir / f'{prefix}_exploded_materials.parquet')
+
+
+def explode_all(player: str,
+                perf_type: str,
+                data_date: date,
+                local_stockfish: bool,
+                io_dir: Path,
+                ) -> None:
+    """
+    Run the four explode steps in a single pass over `cleaned_df`.
+
+    `cleaned_df` is read once, and only for the list columns that get
+    exploded.
+    """
+    prefix: str = get_output_file_prefix(player=player,
+                                         perf_type=perf_type,
+                                         data_date=data_date,
+                                         )
+    explode_steps = {'moves': ('exploded_moves', _explode_moves),
+                     'clocks': ('exploded_clocks', _explode_clocks),
+                     'positions': ('exploded_positions', _explode_positions),
+                     'material_by_move': ('exploded_materials',
+                                          _explode_materials),
+                     }
+
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['game_link', *explode_steps],
+                         )
+    # moves, clocks and positions have one entry per half move, so they
+    # share the half move numbers. the materials also count the starting
+    # position, and games without clock annotations have no clocks, so the
+    # numbers are only built again for lists of other lengths
+    half_moves_by_lengths: list[tuple[np.ndarray, np.ndarray]] = []
+    for column, (output, explode_step) in explode_steps.items():
+        output_path: Path = io_dir / f'{prefix}_{output}.parquet'
+        if df.empty:
+            write_step_output(df, output_path)
+            continue
+
+        lengths: np.ndarray = get_exploded_lengths(df[column])
+        half_moves: np.ndarray | None = next(
+            (numbers
+             for known_lengths, numbers in half_moves_by_lengths
+             if np.array_equal(known_lengths, lengths)),
+            None,
+        )
+        if half_moves is None:
+            half_moves = get_half_moves_from_lengths(lengths)
+            half_moves_by_lengths.append((lengths, half_moves))
+
+        write_step_output(explode_step(df, half_moves), output_path)
@@ -5,7 +5,11 @@ from pathlib import Path
 
 import pandas as pd
 from pipeline_import.models import predict_wp
-from utils.output import get_output_file_prefix
+from utils.output import (
+    get_output_file_prefix,
+    read_step_input,
+    write_step_output,
+)
 
 
 def estimate_win_probabilities(player: str,
@@ -19,13 +23,33 @@ def estimate_win_probabilities(player: str,
                                          data_date=data_date,
                                          )
     # TODO: rename output files / consolidate naming to single location
-    game_infos = pd.read_parquet(io_dir / f'{prefix}_game_infos.parquet')
-    evals = pd.read_parquet(io_dir / f'{prefix}_evals.parquet')
-    positions = pd.read_parquet(io_dir / f'{prefix}_exploded_positions.parquet')  # noqa
-    game_clocks = pd.read_parquet(io_dir / f'{prefix}_exploded_clocks.parquet')
+    game_infos = read_step_input(io_dir / f'{prefix}_game_infos.parquet',
+                                 columns=['game_link',
+                                          'increment',
+                                          'player_color',
+                                          'player_elo',
+                                          'opponent_elo',
+                                          ],
+                                 )
+    evals = read_step_input(io_dir / f'{prefix}_evals.parquet',
+                            columns=['fen_hash',
+                                     'fen',
+                                     'evaluation',
+                                     'eval_depth',
+                                     ],
+                            )
+    positions = read_step_input(
+        io_dir / f'{prefix}_exploded_positions.parquet',
+        columns=['game_link', 'half_move', 'fen_hash', 'fen'],
+    )
+    game_clocks = read_step_input(io_dir / f'{prefix}_exploded_clocks.parquet',
+                                  columns=['game_link', 'clock', 'half_move'],
+                                  )
+
+    output_path: Path = io_dir / f'{prefix}_win_probabilities.parquet'
 
     if all(df.empty for df in [game_infos, evals, positions, game_clocks]):
-        game_infos.to_parquet(io_dir / f'{prefix}_win_probabilities.parquet')
+        write_step_output(game_infos, output_path)
         return
 
     game_infos['has_increment'] = (game_infos['increment'] > 0).astype(int)
@@ -37,8 +61,14 @@ def estimate_win_probabilities(player: str,
                        'opponent_elo',
                        ]
 
-    # evals isn't always populated
-    df = pd.merge(positions, evals, on='fen', how='left')
+    # evals isn't always populated.
+    # join on the hash as well as the fen, so a hash collision can't attach
+    # the evaluation of another position, and only keep one evaluation per
+    # position to avoid duplicating rows
+    join_cols = ['fen_hash', 'fen']
+    evals = evals[join_cols + ['evaluation', 'eval_depth']]
+    evals = evals.drop_duplicates(subset=join_cols)
+    df = pd.merge(positions, evals, on=join_cols, how='left')
 
     # if there are missing evals, set to 0 so it doesn't influence the WP
     if not local_stockfish:
@@ -49,8 +79,19 @@ def estimate_win_probabilities(player: str,
         # i am just ignoring this for now
 
     df = pd.merge(df, game_clocks, on=['game_link', 'half_move'])
+
+    # the exploded files carry game_link as a categorical, so encode the
+    # game infos the same way to merge on the codes
+    game_infos = game_infos[game_infos_cols]
+    if isinstance(df['game_link'].dtype, pd.CategoricalDtype):
+        categories = df['game_link'].cat.categories
+        game_infos = game_infos.assign(
+            game_link=pd.Categorical(game_infos['game_link'],
+                                     categories=categories,
+                                     ),
+        )
     df = pd.merge(df,
-                  game_infos[game_infos_cols],
+                  game_infos,
                   on='game_link',
                   )
 
@@ -69,4 +110,4 @@ def estimate_win_probabilities(player: str,
         md5 = hashlib.md5(f.read()).hexdigest()
 
     df['win_prob_model_version'] = md5[:7]
-    df.to_parquet(io_dir / f'{prefix}_win_probabilities.parquet')
+    write_step_output(df, output_path)
@@ -1,13 +1,91 @@
 #! /usr/bin/env python3
 
 import configparser
+import os
+from collections.abc import Iterator, Mapping
+from functools import cache
+from types import MappingProxyType
 
+CONFIG_PATH = '/config/config.toml'
+# options can be overridden with environment variables named like
+# CHESS_PIPELINE__<SECTION>__<OPTION>, e.g. CHESS_PIPELINE__POSTGRES_CFG__HOST
+ENV_PREFIX = 'CHESS_PIPELINE__'
 
-def _load_cfg():
+
+class ConfigSection(Mapping[str, str]):
+    """
+    Read-only section of the config.
+
+    Like configparser's sections, option names are case insensitive and
+    values are only interpolated when they are read, so one bad value
+    doesn't break reading the others.
+    """
+
+    def __init__(self,
+                 options: Mapping[str, str],
+                 overrides: Mapping[str, str] | None = None,
+                 ):
+        self._options = options
+        self._values = {option.lower(): value
+                        for option, value in (overrides or {}).items()}
+
+    def __getitem__(self, option: str) -> str:
+        option = option.lower()
+        if option not in self._values:
+            # keep the interpolated value, since options are read in hot
+            # paths
+            self._values[option] = self._options[option]
+        return self._values[option]
+
+    def __iter__(self) -> Iterator[str]:
+        options = dict.fromkeys(option.lower() for option in self._options)
+        return iter(options | dict.fromkeys(self._values))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({sorted(self)})'
+
+
+def _get_env_overrides() -> dict[str, dict[str, str]]:
+    overrides: dict[str, dict[str, str]] = {}
+    for name, value in os.environ.items():
+        if not name.startswith(ENV_PREFIX):
+            continue
+        section, sep, option = name.removeprefix(ENV_PREFIX).partition('__')
+        if not sep or not section or not option:
+            continue
+        overrides.setdefault(section.lower(), {})[option.lower()] = value
+    return overrides
+
+
+@cache
+def _load_cfg() -> Mapping[str, ConfigSection]:
+    # parsed once per process, since the config is read in hot paths like
+    # getting the remote evaluation of every position
     cfg = configparser.ConfigParser()
-    cfg.read('/config/config.toml')
-    return cfg
+    cfg.read(CONFIG_PATH)
+
+    overrides = _get_env_overrides()
+    # sections only defined by overrides still need a proxy to read from
+    for section in overrides.keys() - cfg.sections():
+        cfg.add_section(section)
+
+    # wrap the section proxies rather than copying them into dicts, which
+    # would interpolate every value up front
+    return MappingProxyType({
+        section: ConfigSection(cfg[section], overrides.get(section))
+        for section in cfg.sections()
+    })
+
+
+def reload_cfg() -> None:
+    """
+    Forget the loaded config, so that the next `get_cfg` reads it again.
+    """
+    _load_cfg.cache_clear()
 
 
-def get_cfg(key: str):
+def get_cfg(key: str) -> ConfigSection:
     return _load_cfg()[key]
@@ -2,13 +2,16 @@
 
 import os
 import pickle
+from functools import cache
 
 import numpy as np
 import numpy.typing as npt
 import pandas as pd
 from pandas.core.groupby import DataFrameGroupBy
+from pipeline_import.transforms import is_in_half_move_order
 
 
+@cache
 def load_win_probability_model():
     file_path: str = os.path.join(os.path.dirname(__file__), 'wp_model.pckl')
     with open(file_path, 'rb') as f:
@@ -17,12 +20,20 @@ def load_win_probability_model():
 
 
 def create_wp_features(df: pd.DataFrame) -> pd.DataFrame:
-    df.sort_values(by=['game_link', 'half_move'], ascending=True, inplace=True)
+    # rows merged from the exploded files are usually already in order, which
+    # is much cheaper to check than sorting on the game link strings
+    if not is_in_half_move_order(df['game_link'], df['half_move']):
+        df.sort_values(by=['game_link', 'half_move'],
+                       ascending=True,
+                       inplace=True,
+                       )
 
     # filter out where we don't have clock times
     df = df[df['clock'] != -1]
 
-    df['opponent_clock'] = df.groupby(['game_link'])['clock'].shift(-1)
+    df['opponent_clock'] = df.groupby(['game_link'],
+                                      observed=True,
+                                      )['clock'].shift(-1)
     df['opponent_clock'] = df['opponent_clock'].fillna(df['opponent_clock'].shift(2))  # noqa
 
     # in situations where there were only one or two moves,
@@ -35,7 +46,9 @@ def create_wp_features(df: pd.DataFrame) -> pd.DataFrame:
     # group by game and player; sometimes players have different clock times
     # (e.g. berserk in arena)
     initial_times_groupby: DataFrameGroupBy = df.groupby(['game_link',
-                                                          'player_to_move'])
+                                                          'player_to_move'],
+                                                         observed=True,
+                                                         )
     # get only first row of the columns we need
     initial_times = initial_times_groupby[['game_link',
                                            'player_to_move',
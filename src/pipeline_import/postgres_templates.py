@@ -5,9 +5,13 @@ from datetime import date
 from pathlib import Path
 
 import adbc_driver_postgresql.dbapi
-import pyarrow.parquet as pq
+import pyarrow as pa
 from pipeline_import.configs import get_cfg
-from utils.output import get_output_file_prefix
+from utils.output import (
+    get_output_file_prefix,
+    get_step_row_count,
+    iter_step_batches,
+)
 
 
 def load_chess_games(player: str,
@@ -45,10 +49,12 @@ def load_position_evals(player: str,
                                          )
     parquet_filename = f'{prefix}_evals'
 
+    # fen has a unique index, so keep the deepest evaluation of each one
     _load_to_table(table_name=table_name,
                    parquet_filename=parquet_filename,
                    id_cols=id_cols,
                    io_dir=io_dir,
+                   dedup_order=['eval_depth desc'],
                    )
 
 
@@ -157,10 +163,51 @@ def load_win_probs(player: str,
                    )
 
 
+def _decode_dictionaries(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    Turn dictionary-encoded columns (e.g. categorical game links) back into
+    plain arrays, so they are ingested as text.
+    """
+    arrays = [column.dictionary_decode()
+              if pa.types.is_dictionary(column.type)
+              else column
+              for column in batch.columns]
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def _get_insert_sql(table_name: str,
+                    temp_table_name: str,
+                    id_cols: list[str],
+                    dedup_order: list[str] | None,
+                    ) -> str:
+    """
+    Get the query inserting the loaded rows, with a `{columns}` placeholder.
+
+    With a `dedup_order`, only the first row per id in that order is
+    inserted, so that unique indexes on the id columns aren't violated by
+    duplicates in the parquet file.
+    """
+    if dedup_order is None:
+        return f"""
+            insert into {table_name} ({{columns}})
+            select {{columns}}
+            from {temp_table_name}
+        """
+
+    id_list = ', '.join(id_cols)
+    return f"""
+        insert into {table_name} ({{columns}})
+        select distinct on ({id_list}) {{columns}}
+        from {temp_table_name}
+        order by {', '.join([id_list] + dedup_order)}
+    """
+
+
 def _load_to_table(table_name: str,
                    parquet_filename: str,
                    id_cols: list[str],
                    io_dir: Path,
+                   dedup_order: list[str] | None = None,
                    ) -> None:
     pg_cfg = get_cfg('postgres_cfg')
 
@@ -172,17 +219,18 @@ def _load_to_table(table_name: str,
                      pg_cfg['database'],
                      )
 
-    reader = pq.ParquetFile(io_dir / f'{parquet_filename}.parquet')
-    if not reader.scan_contents():
+    parquet_path: Path = io_dir / f'{parquet_filename}.parquet'
+    if not get_step_row_count(parquet_path):
         print('did not find any rows to load, exiting')
         return
 
     temp_table_name = f'temp_{table_name}'
 
-    insert_sql = f"""
-        insert into {table_name} ({{columns}})
-        select {{columns}} from {temp_table_name}
-    """
+    insert_sql = _get_insert_sql(table_name=table_name,
+                                 temp_table_name=temp_table_name,
+                                 id_cols=id_cols,
+                                 dedup_order=dedup_order,
+                                 )
 
     get_col_names = f"""
         select column_name from information_schema.columns
@@ -202,8 +250,11 @@ def _load_to_table(table_name: str,
             cur.execute(get_col_names)
             columns = [row[0] for row in cur.fetchall()]
 
+            batches = map(_decode_dictionaries,
+                          iter_step_batches(parquet_path, columns),
+                          )
             rows = cur.adbc_ingest(temp_table_name,
-                                   reader.iter_batches(columns=columns),
+                                   batches,
                                    mode='create',
                                    temporary=True,
                                    )
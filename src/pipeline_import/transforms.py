@@ -1,18 +1,22 @@
 #! /usr/bin/env python3
 
+from __future__ import annotations
+
 import logging
+import queue
 import re
-from datetime import date, timedelta
+import threading
+from contextlib import contextmanager
+from datetime import date
+from functools import cache
 from pathlib import Path
 from subprocess import SubprocessError
-from typing import Type
+from typing import TYPE_CHECKING, Iterator, Type
 
 import chess
-import lichess.api
+import chess.polyglot
+import numpy as np
 import pandas as pd
-import requests
-import stockfish
-import valkey
 from chess.pgn import Game
 from pandas import (
     Series,
@@ -24,15 +28,33 @@ from pandas import (
     to_timedelta,
 )
 from pipeline_import.configs import get_cfg
-from utils.output import get_output_file_prefix
+from utils.output import (
+    get_output_file_prefix,
+    read_step_input,
+    write_step_output,
+)
+from utils.rate_budget import RateBudget
 from utils.types import Json, Visitor
 
+# only the eval step talks to lichess, the remote engine and valkey, so the
+# clients for them are imported when evaluating rather than with the module
+if TYPE_CHECKING:
+    import lichess.api
+    import requests
+    import stockfish
+    import valkey
+
 MAX_CLOUD_API_CALLS_PER_DAY = 3000
 MAX_CLOUD_FUNCTION_CALLS_PER_MONTH = 900_000
-
-
-class LichessApiClient(lichess.api.DefaultApiClient):
-    max_retries = 3
+# calls are counted per period in these valkey keys, and reserved from them
+# in blocks rather than one at a time
+LICHESS_CLOUD_EVALS_KEY = 'lichess-cloud-evals-api-%F'
+REMOTE_EVALS_KEY = 'remote-evals-%Y-%m'
+LICHESS_CLOUD_EVALS_BLOCK_SIZE = 20
+REMOTE_EVALS_BLOCK_SIZE = 100
+# positions sent to the remote engine per call. the cloud function accepts
+# up to 100, but each one takes a while to evaluate
+REMOTE_EVAL_BATCH_SIZE = 25
 
 
 class RemoteEvalUnavailableError(Exception):
@@ -41,18 +63,27 @@ class RemoteEvalUnavailableError(Exception):
     """
 
 
-def _get_lichess_cloud_eval(fen: str,
-                            valkey_client: valkey.Valkey,
-                            valkey_key: str,
-                            ) -> float:
+@cache
+def _get_lichess_api_client() -> lichess.api.DefaultApiClient:
+    import lichess.api
+
+    # the client doesn't keep any state between calls, so it can be shared
+    return lichess.api.DefaultApiClient(max_retries=3)
+
+
+def _get_lichess_cloud_eval(fen: str) -> float:
+    import lichess.api
+
     # get cloud eval if available
-    client = LichessApiClient()
     cloud_eval = lichess.api.cloud_eval(fen=fen,
                                         multiPv=1,
-                                        client=client,
+                                        client=_get_lichess_api_client(),
                                         )
-    valkey_client.incr(valkey_key, 1)
 
+    return parse_cloud_eval(fen=fen, cloud_eval=cloud_eval)
+
+
+def parse_cloud_eval(fen: str, cloud_eval: Json) -> float:
     rating = cloud_eval['pvs'][0]
     if 'cp' in rating:
         rating = rating['cp'] / 100
@@ -64,10 +95,15 @@ def _get_lichess_cloud_eval(fen: str,
     return rating
 
 
-def _get_remote_eval(fen: str,
-                     valkey_client: valkey.Valkey,
-                     valkey_key: str,
-                     ) -> str:
+@cache
+def _get_remote_eval_session() -> requests.Session:
+    import requests
+
+    # keep the connections to the remote engine alive between requests
+    return requests.Session()
+
+
+def _get_remote_evals(fens: list[str]) -> list[str]:
     try:
         cfg = get_cfg('remote_eval')
         remote_eval_url: str = cfg['REMOTE_EVAL_URL']
@@ -75,10 +111,12 @@ def _get_remote_eval(fen: str,
     except KeyError as e:
         raise RemoteEvalUnavailableError('Missing environment variable') from e
 
-    data: dict[str, str] = {'fen': fen}
+    data: dict[str, list[str]] = {'fens': fens}
 
-    r = requests.post(remote_eval_url, headers=headers, data=data)
-    valkey_client.incr(valkey_key, 1)
+    r = _get_remote_eval_session().post(remote_eval_url,
+                                        headers=headers,
+                                        json=data,
+                                        )
 
     try:
         r.raise_for_status()
@@ -87,16 +125,135 @@ def _get_remote_eval(fen: str,
 
     remote_eval_result = r.json()
 
-    return remote_eval_result['result']
+    return remote_eval_result['results']
+
+
+def _get_remote_eval(fen: str) -> str:
+    return _get_remote_evals([fen])[0]
 
 
-def _get_local_eval(sf_location: Path, sf_depth: int, fen: str) -> str:
-    sf = stockfish.Stockfish(sf_location,
-                             depth=sf_depth)
+def get_remote_evals(fens: list[str],
+                     remote_budget: RateBudget,
+                     ) -> dict[str, float]:
+    """
+    Evaluate a batch of `fens` with a single call to the remote engine.
+
+    The call counts once against `remote_budget`. Returns nothing if the
+    budget is spent or the remote engine isn't available.
+    """
+    if not fens or not remote_budget.acquire():
+        return {}
+
+    try:
+        sf_results: list[str] = _get_remote_evals(fens)
+    except RemoteEvalUnavailableError as e:
+        logging.warning('Remote evaluation is not available (potentially '
+                        'missing an environment variable)')
+        logging.warning(e)
+        return {}
 
-    sf.set_fen_position(fen)
-    sf.get_best_move()
-    return sf.info
+    return {fen: _parse_uci_result(uci_result=sf_result, fen=fen)
+            for fen, sf_result in zip(fens, sf_results)}
+
+
+class StockfishPool:
+    """
+    Pool of long-lived stockfish engines.
+
+    Engines are spawned lazily, up to `size` of them, and handed out one at a
+    time through `engine()`. Setting a FEN position sends `ucinewgame`, so an
+    engine can be reused across positions without leaking search state.
+    """
+
+    def __init__(self, sf_location: Path, sf_depth: int, size: int = 1):
+        if size < 1:
+            raise ValueError(f'Pool size must be at least 1, got {size}')
+        self.sf_location = sf_location
+        self.sf_depth = sf_depth
+        self.size = size
+        self._idle: queue.LifoQueue[stockfish.Stockfish] = queue.LifoQueue()
+        self._spawned: int = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> stockfish.Stockfish:
+        import stockfish
+
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if self._spawned < self.size:
+                    self._spawned += 1
+                    spawn = True
+                else:
+                    spawn = False
+
+        if not spawn:
+            # all engines are busy, wait for one to be returned
+            return self._idle.get()
+
+        try:
+            return stockfish.Stockfish(self.sf_location,
+                                       depth=self.sf_depth)
+        except Exception:
+            with self._lock:
+                self._spawned -= 1
+            raise
+
+    @contextmanager
+    def engine(self) -> Iterator[stockfish.Stockfish]:
+        sf = self._acquire()
+        try:
+            yield sf
+        except Exception:
+            # the engine might be in a bad state, so don't hand it out again
+            with self._lock:
+                self._spawned -= 1
+            sf.stockfish.kill()
+            raise
+        else:
+            self._idle.put(sf)
+
+    def close(self) -> None:
+        while True:
+            try:
+                sf = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            sf.stockfish.kill()
+            with self._lock:
+                self._spawned -= 1
+
+    def __enter__(self) -> StockfishPool:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _get_local_eval(sf_location: Path,
+                    sf_depth: int,
+                    fen: str,
+                    sf_pool: StockfishPool | None = None,
+                    ) -> str:
+    if sf_pool is None:
+        import stockfish
+
+        sf = stockfish.Stockfish(sf_location,
+                                 depth=sf_depth)
+
+        sf.set_fen_position(fen)
+        sf.get_best_move()
+        return sf.info
+
+    with sf_pool.engine() as sf:
+        sf.set_fen_position(fen)
+        sf.get_best_move()
+        return sf.info
+
+
+def is_terminal_position(fen: str) -> bool:
+    return _get_terminal_position_rating(fen=fen) is not None
 
 
 def _get_terminal_position_rating(fen: str) -> float | None:
@@ -115,58 +272,59 @@ def _get_terminal_position_rating(fen: str) -> float | None:
         return None
 
 
+def get_eval_budgets(valkey_client: valkey.Valkey,
+                     ) -> tuple[RateBudget, RateBudget]:
+    """
+    Get the budgets of lichess cloud evals and remote evals.
+
+    Should be created once per run and shared by all the evaluations.
+    """
+    lichess_budget = RateBudget(valkey_client=valkey_client,
+                                key_format=LICHESS_CLOUD_EVALS_KEY,
+                                limit=MAX_CLOUD_API_CALLS_PER_DAY,
+                                period='day',
+                                block_size=LICHESS_CLOUD_EVALS_BLOCK_SIZE,
+                                )
+    remote_budget = RateBudget(valkey_client=valkey_client,
+                               key_format=REMOTE_EVALS_KEY,
+                               limit=MAX_CLOUD_FUNCTION_CALLS_PER_MONTH,
+                               period='month',
+                               block_size=REMOTE_EVALS_BLOCK_SIZE,
+                               )
+    return lichess_budget, remote_budget
+
+
 def get_sf_evaluation(fen: str,
                       sf_location: Path,
                       sf_depth: int,
-                      valkey_client: valkey.Valkey,
+                      lichess_budget: RateBudget | None,
+                      remote_budget: RateBudget | None,
+                      sf_pool: StockfishPool | None = None,
                       ) -> float:
-    if (terminal_rating := _get_terminal_position_rating(fen=fen)) is not None:
-        return terminal_rating
-
-    today: date = date.today()
-    tomorrow: date = today + timedelta(days=1)
-    next_month: date = (today.replace(day=1)
-                        + timedelta(days=32)).replace(day=1)
-
-    tomorrow_unix: int = int(tomorrow.strftime('%s'))
-    next_month_unix: int = int(next_month.strftime('%s'))
-
-    api_valkey: str = today.strftime('lichess-cloud-evals-api-%F')
-    remote_valkey: str = today.strftime('remote-evals-%Y-%m')
+    """
+    Evaluate `fen` with the first engine available within its budget.
 
-    lichess_calls: int = int(valkey_client.set(api_valkey,  # pyright: ignore
-                                               0,
-                                               exat=tomorrow_unix,
-                                               nx=True,
-                                               get=True,
-                                               ) or 0)
+    Tries the lichess cloud evals, then the remote engine, then the local
+    one. Pass no budget to skip the cloud evals or the remote engine, e.g.
+    when they were already tried in bulk.
+    """
+    import lichess.api
 
-    remote_calls: int = int(valkey_client.set(remote_valkey,  # pyright: ignore
-                                              0,
-                                              exat=next_month_unix,
-                                              nx=True,
-                                              get=True,
-                                              ) or 0)
+    if (terminal_rating := _get_terminal_position_rating(fen=fen)) is not None:
+        return terminal_rating
 
-    if lichess_calls < MAX_CLOUD_API_CALLS_PER_DAY:
+    if lichess_budget is not None and lichess_budget.acquire():
         try:
-            return _get_lichess_cloud_eval(fen=fen,
-                                           valkey_client=valkey_client,
-                                           valkey_key=api_valkey,
-                                           )
+            return _get_lichess_cloud_eval(fen=fen)
         except lichess.api.ApiHttpError as e:
             logging.warning(f'Got an API HTTP error: {e}')
         except lichess.api.ApiError as e:
-            logging.warning('Hit an API error (potentially a rate limit) '
-                            f'with only {lichess_calls} calls')
+            logging.warning('Hit an API error (potentially a rate limit)')
             logging.warning(e)
 
-    if remote_calls < MAX_CLOUD_FUNCTION_CALLS_PER_MONTH:
+    if remote_budget is not None and remote_budget.acquire():
         try:
-            sf_result: str = _get_remote_eval(fen=fen,
-                                              valkey_client=valkey_client,
-                                              valkey_key=remote_valkey,
-                                              )
+            sf_result: str = _get_remote_eval(fen=fen)
         except RemoteEvalUnavailableError as e:
             logging.warning('Remote evaluation is not available (potentially '
                             'missing an environment variable)')
@@ -178,6 +336,7 @@ def get_sf_evaluation(fen: str,
     sf_result = _get_local_eval(sf_location=sf_location,
                                 sf_depth=sf_depth,
                                 fen=fen,
+                                sf_pool=sf_pool,
                                 )
 
     return _parse_uci_result(uci_result=sf_result, fen=fen)
@@ -218,7 +377,9 @@ def parse_headers(game: Game, visitors: list[Type[Visitor]]) -> Json:
     for visitor in visitors:
         game.accept(visitor(game))
     game_infos: Json = Json({x: y for x, y in game.headers.items()})
-    game_infos['moves'] = [x.san() for x in game.mainline()]
+    if 'moves' not in game_infos:
+        # GameVisitor already collects these while replaying the game
+        game_infos['moves'] = [x.san() for x in game.mainline()]
 
     return game_infos
 
@@ -248,6 +409,104 @@ def get_clean_fens(positions: pd.Series) -> pd.Series:
     return positions.str.split().str[:-1].str.join(' ')
 
 
+def get_position_hashes(fens: pd.Series) -> pd.Series:
+    """
+    Get the 64-bit zobrist hash of each position in `fens`.
+
+    The hash only depends on the board, side to move, castling rights and en
+    passant square, so it is a compact key for looking up evaluations.
+    Games without moves explode into a row without a position, which gets
+    a null hash.
+    """
+    # exploded frames can have duplicate index labels, so mask by position
+    has_fen: np.ndarray = fens.notna().to_numpy()
+    valid_fens = fens[has_fen]
+    hashes = np.fromiter((chess.polyglot.zobrist_hash(chess.Board(fen))
+                          for fen in valid_fens),
+                         dtype=np.uint64,
+                         count=len(valid_fens),
+                         )
+    # postgres doesn't have unsigned ints, so store the bits as a bigint
+    fen_hashes = pd.Series(pd.NA,
+                           index=fens.index,
+                           name='fen_hash',
+                           dtype='Int64',
+                           )
+    fen_hashes[has_fen] = hashes.view(np.int64)
+    return fen_hashes
+
+
+def get_half_moves_from_lengths(lengths: np.ndarray) -> np.ndarray:
+    """
+    Number consecutive runs of rows from 1, given the length of each run.
+    """
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(lengths.sum()) - starts + 1
+
+
+def get_exploded_lengths(lists: pd.Series) -> np.ndarray:
+    """
+    Get the number of rows each list in `lists` explodes into.
+
+    Empty or missing lists explode into a single row, like `Series.explode`.
+    """
+    lengths = (lists.map(len, na_action='ignore')
+                    .fillna(0)
+                    .to_numpy(dtype=np.int64))
+    return np.maximum(lengths, 1)
+
+
+def get_half_moves(lists: pd.Series) -> np.ndarray:
+    """
+    Number the elements of each list in `lists` from 1, in exploded order.
+
+    This replaces a `groupby('game_link').cumcount()` after exploding, which
+    hashes the game link of every row.
+    """
+    return get_half_moves_from_lengths(get_exploded_lengths(lists))
+
+
+def is_in_half_move_order(game_links: pd.Series,
+                          half_moves: pd.Series,
+                          ) -> bool:
+    """
+    Whether every game is a single run of rows numbered 1, 2, 3, ...
+
+    That's the order the explode steps write rows in, so frames built from
+    them don't need to be sorted by game link and half move again.
+    """
+    if game_links.empty:
+        return True
+
+    # compare the integer codes rather than the strings when possible
+    if isinstance(game_links.dtype, pd.CategoricalDtype):
+        links = game_links.cat.codes.to_numpy()
+    else:
+        links = game_links.to_numpy()
+    new_game = np.ones(len(links), dtype=bool)
+    new_game[1:] = links[1:] != links[:-1]
+    starts = np.flatnonzero(new_game)
+
+    # a game split over several runs
+    if pd.Series(links[starts]).duplicated().any():
+        return False
+
+    lengths = np.diff(np.append(starts, len(links)))
+    return np.array_equal(half_moves.to_numpy(),
+                          get_half_moves_from_lengths(lengths),
+                          )
+
+
+# per-move list columns of cleaned_df, only used by the explode and eval steps
+PER_MOVE_COLUMNS = ['evaluations',
+                    'eval_depths',
+                    'clocks',
+                    'positions',
+                    'material_by_move',
+                    'moves',
+                    ]
+
+
 def transform_game_data(player: str,
                         perf_type: str,
                         data_date: date,
@@ -258,9 +517,11 @@ def transform_game_data(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         exclude=PER_MOVE_COLUMNS,
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_game_infos.parquet')
+        write_step_output(df, io_dir / f'{prefix}_game_infos.parquet')
         return
     df['player'] = player
 
@@ -390,7 +651,7 @@ def transform_game_data(player: str,
         df[column] = df[column].replace('?', '1500')
         df[column] = to_numeric(df[column])
 
-    df.to_parquet(io_dir / f'{prefix}_game_infos.parquet')
+    write_step_output(df, io_dir / f'{prefix}_game_infos.parquet')
 
 
 def get_color_stats(df):
@@ -1,12 +1,86 @@
 #! /usr/bin/env python
 
 import re
-from collections import Counter
-from datetime import datetime
 
 import chess
 from chess.pgn import BaseVisitor
 
+COMMENT_ANNOTATION_RE = re.compile(r'\[%(eval|clk) ([^\]]+)')
+
+
+def parse_comment(comment: str) -> tuple[str | None, str | None]:
+    """
+    Extract the `%eval` and `%clk` annotations from a lichess PGN comment.
+
+    Both are found in a single scan of the comment. Returns the raw strings
+    (e.g. `'0.16'` or `'#-3'`, and `'0:01:00'`), or None if an annotation is
+    missing.
+    """
+    evaluation: str | None = None
+    clock: str | None = None
+    for annotation, value in COMMENT_ANNOTATION_RE.findall(comment):
+        if annotation == 'eval':
+            if evaluation is None:
+                evaluation = value
+        elif clock is None:
+            clock = value
+    return evaluation, clock
+
+
+# order of the piece counts in each entry of `material_by_move`
+MATERIAL_PIECES = ['P', 'N', 'B', 'R', 'Q', 'p', 'n', 'b', 'r', 'q']
+MATERIAL_PIECE_TYPES = [chess.PAWN,
+                        chess.KNIGHT,
+                        chess.BISHOP,
+                        chess.ROOK,
+                        chess.QUEEN,
+                        ]
+
+
+def _material_index(piece_type: chess.PieceType, color: chess.Color) -> int:
+    return (0 if color == chess.WHITE else 5) + piece_type - 1
+
+
+def count_material(board: chess.Board) -> list[int]:
+    """
+    Count the pieces (excluding kings) on `board`, in `MATERIAL_PIECES` order.
+    """
+    return [chess.popcount(board.pieces_mask(piece_type, color))
+            for color in [chess.WHITE, chess.BLACK]
+            for piece_type in MATERIAL_PIECE_TYPES
+            ]
+
+
+def update_material(material: list[int],
+                    board: chess.Board,
+                    move: chess.Move,
+                    ) -> None:
+    """
+    Update `material` in place for `move` being played on `board`.
+
+    Only captures and promotions change the material on the board.
+    """
+    if board.is_en_passant(move):
+        material[_material_index(chess.PAWN, not board.turn)] -= 1
+    else:
+        captured = board.piece_at(move.to_square)
+        # chess960 castling is encoded as the king capturing its own rook
+        if captured is not None and captured.color != board.turn:
+            material[_material_index(captured.piece_type,
+                                     captured.color)] -= 1
+
+    if move.promotion is not None:
+        material[_material_index(chess.PAWN, board.turn)] -= 1
+        material[_material_index(move.promotion, board.turn)] += 1
+
+
+def clock_to_seconds(clock: str) -> int:
+    """
+    Convert a `%clk` annotation like `'0:01:00'` to seconds.
+    """
+    hours, minutes, seconds = clock.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
 
 class EvalsVisitor(BaseVisitor):
 
@@ -16,9 +90,8 @@ class EvalsVisitor(BaseVisitor):
         self.game.headers._others['eval_depths'] = []
 
     def visit_comment(self, comment):
-        if (eval_match := re.search(r'\[%eval ([^\]]+)', comment)) is not None:
-            evaluation = eval_match.group(1)
-
+        evaluation, _ = parse_comment(comment)
+        if evaluation is not None:
             # if it's a checkmate sequence
             if evaluation.startswith('#'):
                 # if it's a checkmate for black, it'll be e.g. #-30
@@ -57,16 +130,15 @@ class ClocksVisitor(BaseVisitor):
         self.game.headers._others['black_berserked'] = False
 
     def visit_comment(self, comment):
-        if (clock_match := re.search(r'\[%clk ([^\]]+)', comment)) is not None:
-            clock_time = clock_match.group(1)
-        else:
+        _, clock_time = parse_comment(comment)
+        if clock_time is None:
             clock_time = ''
 
         # berserked games stuff
         if len(self.game.headers._others['clocks']) == 0:
-            self.white_clock = datetime.strptime(clock_time, '%H:%M:%S')
+            self.white_clock = clock_to_seconds(clock_time)
         elif len(self.game.headers._others['clocks']) == 1:
-            self.black_clock = datetime.strptime(clock_time, '%H:%M:%S')
+            self.black_clock = clock_to_seconds(clock_time)
         elif len(self.game.headers._others['clocks']) == 2:
             if self.black_clock > self.white_clock:
                 self.game.headers._others['white_berserked'] = True
@@ -184,13 +256,192 @@ class MaterialVisitor(BaseVisitor):
     def __init__(self, gm):
         self.game = gm
         self.game.headers._others['material_by_move'] = []
+        self.material = None
+
+    def begin_variation(self):
+        # the material has to be recounted when switching lines
+        self.material = None
+
+    def end_variation(self):
+        self.material = None
+
+    def visit_move(self, board, move):
+        if self.material is None:
+            self.material = count_material(board)
+        update_material(self.material, board, move)
+
+    def visit_board(self, board):
+        if self.material is None:
+            self.material = count_material(board)
+        self.game.headers._others['material_by_move'].append(self.material.copy())  # noqa
+
+    def result(self):
+        return None
+
+
+class GameVisitor(BaseVisitor):
+    """
+    Single-pass combination of all the visitors above.
+
+    Produces the same headers as running the evals, clocks, queen exchange,
+    castling, promotions, positions and material visitors one after the
+    other, plus the SAN `moves` of the mainline, while only replaying the
+    game once.
+    """
+
+    def __init__(self, gm):
+        self.game = gm
+
+        # keys are set up front so they're in the same order as when each
+        # visitor is run separately
+        self.game.headers._others['evaluations'] = []
+        self.game.headers._others['eval_depths'] = []
+        self.game.headers._others['clocks'] = []
+        self.game.headers._others['white_berserked'] = False
+        self.game.headers._others['black_berserked'] = False
+        self.game.headers._others['queen_exchange'] = False
+        self.game.headers._others['castling_sides'] = {'black': None,
+                                                       'white': None,
+                                                       }
+        self.game.headers._others['has_promotion'] = False
+        self.game.headers._others['promotion_count'] = {str(chess.WHITE): 0,
+                                                        str(chess.BLACK): 0,
+                                                        }
+        self.game.headers._others['promotions'] = {str(chess.WHITE): [],
+                                                   str(chess.BLACK): [],
+                                                   }
+        self.game.headers._others['promotion_count_white'] = 0
+        self.game.headers._others['promotion_count_black'] = 0
+        self.game.headers._others['promotions_white'] = ''
+        self.game.headers._others['promotions_black'] = ''
+        self.game.headers._others['positions'] = []
+        self.game.headers._others['material_by_move'] = []
+        self.game.headers._others['moves'] = []
+
+        self.first_move = True
+        self.move_counter = 0
+        self.captured_at = 0
+        self.variation_depth = 0
+        self.material = None
+
+    def begin_variation(self):
+        self.variation_depth += 1
+        # the material has to be recounted when switching lines
+        self.material = None
+
+    def end_variation(self):
+        self.variation_depth -= 1
+        self.material = None
+
+    def visit_comment(self, comment):
+        headers = self.game.headers._others
+
+        evaluation, clock_time = parse_comment(comment)
+
+        # evaluations
+        if evaluation is not None:
+            # if it's a checkmate sequence
+            if evaluation.startswith('#'):
+                # if it's a checkmate for black, it'll be e.g. #-30
+                if '-' in evaluation:
+                    evaluation = '-9999'
+                else:  # otherwise it's for white, e.g. #30
+                    evaluation = '9999'
+            headers['evaluations'].append(float(evaluation))
+            headers['eval_depths'].append(20)
+        elif headers['evaluations']:
+            # no eval for this position, so we're usually in a checkmate
+            # position. see EvalsVisitor
+            results_map = {'1-0': 9999.0,
+                           '0-1': -9999.0,
+                           }
+
+            result = results_map[self.game.headers['Result']]
+
+            headers['evaluations'].append(result)
+            headers['eval_depths'].append(20)
+
+        # clocks
+        if clock_time is None:
+            clock_time = ''
+
+        # berserked games stuff
+        if len(headers['clocks']) == 0:
+            self.white_clock = clock_to_seconds(clock_time)
+        elif len(headers['clocks']) == 1:
+            self.black_clock = clock_to_seconds(clock_time)
+        elif len(headers['clocks']) == 2:
+            if self.black_clock > self.white_clock:
+                headers['white_berserked'] = True
+            elif self.white_clock > self.black_clock:
+                headers['black_berserked'] = True
+
+        headers['clocks'].append(clock_time)
+
+    def visit_move(self, board, move):
+        headers = self.game.headers._others
+
+        # moves, only for the mainline like `Game.mainline()`
+        if not self.variation_depth:
+            headers['moves'].append(board.san(move))
+
+        # queen exchange
+        self.move_counter += 1
+        dest = board.piece_at(move.to_square)
+        if dest is not None and dest.piece_type == chess.QUEEN:
+            if self.captured_at == self.move_counter - 1:
+                headers['queen_exchange'] = True
+            self.captured_at = self.move_counter
+
+        # castling
+        from_sq = board.piece_at(move.from_square)
+        if from_sq is not None and from_sq.piece_type == chess.KING:
+            if move.to_square == chess.G8:
+                headers['castling_sides']['black'] = 'kingside'
+            elif move.to_square == chess.G1:
+                headers['castling_sides']['white'] = 'kingside'
+            elif move.to_square == chess.C8:
+                headers['castling_sides']['black'] = 'queenside'
+            elif move.to_square == chess.C1:
+                headers['castling_sides']['white'] = 'queenside'
+
+        # promotions
+        if move.promotion is not None:
+            headers['has_promotion'] = True
+            headers['promotion_count'][str(board.turn)] += 1
+
+            piece_symbol = chess.piece_symbol(move.promotion)
+            headers['promotions'][str(board.turn)].append(piece_symbol)
+
+        # material
+        if self.material is None:
+            self.material = count_material(board)
+        update_material(self.material, board, move)
 
     def visit_board(self, board):
-        pieces = board.piece_map()
-        symbols = [v.symbol() for k, v in pieces.items()]
+        headers = self.game.headers._others
+
+        # positions
+        if not self.first_move:
+            headers['positions'].append(board.fen())
+        self.first_move = False
+
+        # material
+        if self.material is None:
+            self.material = count_material(board)
+        headers['material_by_move'].append(self.material.copy())
+
+    def end_game(self):
+        headers = self.game.headers._others
+
+        headers['promotion_count_white'] = headers['promotion_count'][str(chess.WHITE)]  # noqa
+        headers['promotion_count_black'] = headers['promotion_count'][str(chess.BLACK)]  # noqa
+
+        promotions = sorted(headers['promotions'][str(chess.WHITE)])
+        headers['promotions_white'] = ''.join(promotions)
 
-        summary = Counter(symbols)
-        self.game.headers._others['material_by_move'].append(summary)
+        promotions = sorted(headers['promotions'][str(chess.BLACK)])
+        headers['promotions_black'] = ''.join(promotions)
 
     def result(self):
         return None
@@ -1,8 +1,20 @@
 
+from functools import cache
+
+import adbc_driver_postgresql.dbapi
 import pandas as pd
+import pyarrow as pa
+import sqlalchemy
 from pipeline_import.configs import get_cfg
 
 
+@cache
+def _get_engine(db_conn_string: str) -> sqlalchemy.Engine:
+    # keep one engine per database so its connections are pooled and reused
+    # by every query made in the same process
+    return sqlalchemy.create_engine(db_conn_string)
+
+
 def run_remote_sql_query(sql, **params) -> pd.DataFrame:
     pg_cfg = get_cfg('postgres_cfg')
 
@@ -14,7 +26,43 @@ def run_remote_sql_query(sql, **params) -> pd.DataFrame:
                                            pg_cfg['database'],
                                            )
 
-    df: pd.DataFrame = pd.read_sql_query(sql, db_conn_string, params=params)
+    df: pd.DataFrame = pd.read_sql_query(sql,
+                                         _get_engine(db_conn_string),
+                                         params=params,
+                                         )
+
+    return df
+
+
+def run_remote_sql_query_with_table(sql: str,
+                                    table_name: str,
+                                    table: pa.Table,
+                                    ) -> pd.DataFrame:
+    """
+    Ingest `table` into a temporary table called `table_name`, then run `sql`.
+
+    Useful when `sql` needs to filter on more values than is reasonable to
+    send as query parameters.
+    """
+    pg_cfg = get_cfg('postgres_cfg')
+
+    uri = 'postgresql://{}:{}@{}:{}/{}'
+    uri = uri.format(pg_cfg['user'],
+                     pg_cfg['password'],
+                     pg_cfg['host'],
+                     pg_cfg['port'],
+                     pg_cfg['database'],
+                     )
+
+    with adbc_driver_postgresql.dbapi.connect(uri) as conn:
+        with conn.cursor() as cur:
+            cur.adbc_ingest(table_name,
+                            table,
+                            mode='create',
+                            temporary=True,
+                            )
+            cur.execute(sql)
+            df: pd.DataFrame = cur.fetch_arrow_table().to_pandas()
 
     return df
 
@@ -0,0 +1,94 @@
+"""
+Local cache of position evaluations, kept in valkey.
+"""
+
+import time
+
+import pandas as pd
+import valkey
+
+EVAL_COLUMNS = ['fen', 'evaluation', 'eval_depth']
+
+
+class EvalCache:
+    """
+    LRU cache of position evaluations keyed by normalized FEN.
+
+    Evaluations are stored in a valkey hash as `'{evaluation} {eval_depth}'`
+    strings. A sorted set of last-access times is kept next to it so that the
+    least recently used positions can be evicted once the cache grows past
+    `max_size` entries.
+    """
+
+    evals_key: str = 'position-evals-cache'
+    access_key: str = 'position-evals-cache-lru'
+
+    def __init__(self, valkey_client: valkey.Valkey, max_size: int):
+        if max_size < 1:
+            raise ValueError(f'Cache size must be at least 1, got {max_size}')
+        self.valkey_client = valkey_client
+        self.max_size = max_size
+
+    def get_many(self, fens: list[str], min_depth: int = 0) -> pd.DataFrame:
+        """
+        Get the cached evaluations for `fens`, skipping cache misses.
+
+        Evaluations shallower than `min_depth` count as misses, so that the
+        position is evaluated again at the depth asked for.
+        """
+        if not fens:
+            return pd.DataFrame([], columns=EVAL_COLUMNS)
+
+        values: list[str | None] = self.valkey_client.hmget(  # pyright: ignore
+            self.evals_key,
+            fens,
+        )
+
+        rows: list[tuple[str, float, int]] = []
+        for fen, value in zip(fens, values):
+            if value is None:
+                continue
+            evaluation, eval_depth = value.split()
+            if int(eval_depth) < min_depth:
+                continue
+            rows.append((fen, float(evaluation), int(eval_depth)))
+
+        if rows:
+            now: float = time.time()
+            self.valkey_client.zadd(self.access_key,
+                                    {fen: now for fen, _, _ in rows},
+                                    )
+
+        return pd.DataFrame(rows, columns=EVAL_COLUMNS)
+
+    def set_many(self, evals: pd.DataFrame) -> None:
+        """
+        Store the evaluations in `evals`, evicting old ones if needed.
+
+        `evals` must have the `fen`, `evaluation` and `eval_depth` columns.
+        """
+        if evals.empty:
+            return
+
+        mapping: dict[str, str] = {
+            fen: f'{evaluation} {int(eval_depth)}'
+            for fen, evaluation, eval_depth
+            in evals[EVAL_COLUMNS].itertuples(index=False)
+        }
+        now: float = time.time()
+
+        with self.valkey_client.pipeline() as pipe:
+            pipe.hset(self.evals_key, mapping=mapping)
+            pipe.zadd(self.access_key, dict.fromkeys(mapping, now))
+            pipe.zcard(self.access_key)
+            *_, cache_size = pipe.execute()
+
+        if cache_size > self.max_size:
+            evicted = self.valkey_client.zpopmin(  # pyright: ignore
+                self.access_key,
+                cache_size - self.max_size,
+            )
+            self.valkey_client.hdel(self.evals_key,
+                                    *[fen for fen, _ in evicted],
+                                    )
+            print(f'Evicted {len(evicted)} positions from the eval cache')
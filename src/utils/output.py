@@ -4,7 +4,26 @@ Generic utils.
 TODO: move to a better location.
 """
 
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# every step imports this module, including the loaders that never touch
+# pandas. pyarrow imports it itself when converting tables
+if TYPE_CHECKING:
+    import pandas as pd
+
+# step outputs handed directly to the next steps, keyed by file path. only
+# set inside `keep_outputs_in_memory`
+_in_memory_outputs: dict[Path, pd.DataFrame] | None = None
+_checkpoints: frozenset[str] = frozenset()
 
 
 def get_output_file_prefix(player: str,
@@ -13,3 +32,125 @@ def get_output_file_prefix(player: str,
                            ) -> str:
     prefix = f'{data_date.strftime("%F")}_{player}_{perf_type}'
     return prefix
+
+
+@contextmanager
+def keep_outputs_in_memory(checkpoints: Iterable[str] = ()) -> Iterator[None]:
+    """
+    Pass step outputs to the following steps in memory instead of on disk.
+
+    Inside the context, `write_step_output` keeps DataFrames in memory and
+    `read_step_input` returns them without a parquet round trip. Outputs
+    whose name is in `checkpoints` (e.g. `cleaned_df`, the part of the file
+    name after the prefix) are still written to disk as well. Files that
+    weren't written inside the context are read from disk as usual.
+    """
+    global _in_memory_outputs, _checkpoints
+
+    previous = (_in_memory_outputs, _checkpoints)
+    _in_memory_outputs = {}
+    _checkpoints = frozenset(checkpoints)
+    try:
+        yield
+    finally:
+        _in_memory_outputs, _checkpoints = previous
+
+
+def _is_checkpoint(path: Path) -> bool:
+    return any(path.name.endswith(f'_{name}.parquet') for name in _checkpoints)
+
+
+def write_step_output(df: pd.DataFrame, path: Path) -> None:
+    """
+    Write the output of a step to `path`, or keep it in memory if enabled.
+    """
+    if _in_memory_outputs is None or _is_checkpoint(path):
+        df.to_parquet(path)
+    if _in_memory_outputs is not None:
+        _in_memory_outputs[path] = df
+
+
+def _select_columns(names: list[str],
+                    columns: Iterable[str] | None,
+                    exclude: Iterable[str],
+                    ) -> list[str]:
+    if columns is None:
+        columns = names
+    excluded = set(exclude)
+    return [column for column in columns
+            if column in names and column not in excluded]
+
+
+def read_step_input(path: Path,
+                    columns: Iterable[str] | None = None,
+                    exclude: Iterable[str] = (),
+                    ) -> pd.DataFrame:
+    """
+    Read the parquet file written by a previous step, projected on `columns`.
+
+    Only the requested columns are deserialized, which matters for the
+    per-move list columns of `cleaned_df`. Columns that aren't in the file
+    are skipped, since empty outputs are written without any columns. The
+    number of bytes read is printed.
+    """
+    if _in_memory_outputs is not None and path in _in_memory_outputs:
+        df = _in_memory_outputs[path]
+        selected = _select_columns(df.columns.tolist(), columns, exclude)
+        print(f'Read {len(selected)} of {len(df.columns)} columns of '
+              f'{path.name} from memory')
+        return df[selected]
+
+    parquet_file = pq.ParquetFile(path)
+    schema = parquet_file.schema_arrow
+    # the index is stored as extra columns and always read back
+    index_columns: list[str] = [
+        column
+        for column in (schema.pandas_metadata or {}).get('index_columns', [])
+        if isinstance(column, str)
+    ]
+    names: list[str] = [name for name in schema.names
+                        if name not in index_columns]
+    selected: list[str] = _select_columns(names, columns, exclude)
+
+    metadata = parquet_file.metadata
+    # nested columns are stored as leaf columns like `moves.list.element`
+    read_bytes = 0
+    total_bytes = 0
+    for row_group in range(metadata.num_row_groups):
+        row_group_metadata = metadata.row_group(row_group)
+        for column in range(row_group_metadata.num_columns):
+            column_metadata = row_group_metadata.column(column)
+            size: int = column_metadata.total_compressed_size
+            total_bytes += size
+            name: str = column_metadata.path_in_schema.split('.')[0]
+            if name in selected or name in index_columns:
+                read_bytes += size
+    print(f'Read {read_bytes:,} of {total_bytes:,} bytes '
+          f'({len(selected)} of {len(names)} columns) from {path.name}')
+
+    table = pq.read_table(path, columns=selected, use_pandas_metadata=True)
+    return table.to_pandas()
+
+
+def get_step_row_count(path: Path) -> int:
+    """
+    Get the number of rows of a step output without reading its data.
+    """
+    if _in_memory_outputs is not None and path in _in_memory_outputs:
+        return len(_in_memory_outputs[path])
+    return pq.read_metadata(path).num_rows
+
+
+def iter_step_batches(path: Path,
+                      columns: list[str],
+                      ) -> Iterator[pa.RecordBatch]:
+    """
+    Iterate over a step output as arrow record batches of `columns`.
+    """
+    if _in_memory_outputs is not None and path in _in_memory_outputs:
+        df = _in_memory_outputs[path]
+        table = pa.Table.from_pandas(df[columns], preserve_index=False)
+        yield from table.to_batches()
+        return
+
+    yield from pq.ParquetFile(path).iter_batches(columns=columns)
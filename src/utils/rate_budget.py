@@ -0,0 +1,112 @@
+"""
+Budgets of calls to rate limited APIs, shared through valkey.
+"""
+
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import TYPE_CHECKING
+
+# the client is passed in, so only needed for annotations
+if TYPE_CHECKING:
+    import valkey
+
+RATE_BUDGET_PERIODS = ['day', 'month']
+
+
+def _get_period_end(today: date, period: str) -> date:
+    if period == 'day':
+        return today + timedelta(days=1)
+    return (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+class RateBudget:
+    """
+    Budget of at most `limit` calls per day or month to an API.
+
+    The calls made by every worker are counted in a valkey key named after
+    the current period with `key_format` (a `strftime` format), which
+    expires once the period is over. Instead of incrementing the counter on
+    every call, tokens are reserved from it in blocks of `block_size` with a
+    single `INCRBY` and handed out locally. Tokens left over when the budget
+    is closed are given back, so other workers can use them.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self,
+                 valkey_client: valkey.Valkey,
+                 key_format: str,
+                 limit: int,
+                 period: str,
+                 block_size: int = 100,
+                 ):
+        if period not in RATE_BUDGET_PERIODS:
+            raise ValueError(f'Unknown rate budget period {period}')
+        if block_size < 1:
+            raise ValueError('Block size must be at least 1, '
+                             f'got {block_size}')
+        self.valkey_client = valkey_client
+        self.key_format = key_format
+        self.limit = limit
+        self.period = period
+        self.block_size = block_size
+        # tokens reserved from the counter at `_key` that weren't used yet
+        self._key: str | None = None
+        self._tokens: int = 0
+        self._exhausted_key: str | None = None
+        self._lock = threading.Lock()
+
+    def _reserve(self, key: str, today: date) -> None:
+        period_end = datetime.combine(_get_period_end(today, self.period),
+                                      time(),
+                                      )
+        with self.valkey_client.pipeline() as pipe:
+            pipe.incrby(key, self.block_size)
+            pipe.expireat(key, period_end, nx=True)
+            reserved, _ = pipe.execute()
+
+        # other workers may have reserved tokens in the meantime, so only
+        # keep the part of the block that fits under the limit
+        tokens: int = max(0, min(self.block_size,
+                                 self.limit - (reserved - self.block_size)))
+        if tokens < self.block_size:
+            self.valkey_client.decrby(key, self.block_size - tokens)
+            self._exhausted_key = key
+
+        self._key = key
+        self._tokens = tokens
+
+    def acquire(self) -> bool:
+        """
+        Take a token for one call. Returns False if the budget is spent.
+        """
+        today: date = date.today()
+        key: str = today.strftime(self.key_format)
+
+        with self._lock:
+            if self._key != key:
+                # a new period started, so the old tokens can't be returned
+                self._tokens = 0
+            if not self._tokens and self._exhausted_key != key:
+                self._reserve(key, today)
+            if not self._tokens:
+                return False
+            self._tokens -= 1
+            return True
+
+    def close(self) -> None:
+        """
+        Give the tokens that weren't used back to the shared counter.
+        """
+        with self._lock:
+            if self._key is not None and self._tokens:
+                self.valkey_client.decrby(self._key, self._tokens)
+            self._tokens = 0
+
+    def __enter__(self) -> RateBudget:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
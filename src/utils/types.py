@@ -4,6 +4,7 @@ from pipeline_import.visitors import (
     CastlingVisitor,
     ClocksVisitor,
     EvalsVisitor,
+    GameVisitor,
     MaterialVisitor,
     PositionsVisitor,
     PromotionsVisitor,
@@ -14,6 +15,7 @@ Json = NewType('Json', dict[str, Any])
 Visitor = (CastlingVisitor |
            ClocksVisitor |
            EvalsVisitor |
+           GameVisitor |
            MaterialVisitor |
            PositionsVisitor |
            PromotionsVisitor |
@@ -8,16 +8,12 @@ from chess.pgn import Game
 from lichess.format import JSON, PYCHESS
 from pipeline_import.configs import get_cfg
 from pipeline_import.transforms import parse_headers
-from pipeline_import.visitors import (
-    CastlingVisitor,
-    ClocksVisitor,
-    EvalsVisitor,
-    MaterialVisitor,
-    PositionsVisitor,
-    PromotionsVisitor,
-    QueenExchangeVisitor,
+from pipeline_import.visitors import GameVisitor
+from utils.output import (
+    get_output_file_prefix,
+    get_step_row_count,
+    write_step_output,
 )
-from utils.output import get_output_file_prefix
 from utils.types import Json, Visitor
 from zoneinfo import ZoneInfo
 
@@ -55,7 +51,7 @@ def fetch_lichess_api_json(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df.to_parquet(io_dir / f'{prefix}_raw_json.parquet')
+    write_step_output(df, io_dir / f'{prefix}_raw_json.parquet')
 
 
 def fetch_lichess_api_pgn(player: str,
@@ -68,8 +64,9 @@ def fetch_lichess_api_pgn(player: str,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    json = pd.read_parquet(io_dir / f'{prefix}_raw_json.parquet')
-    game_count = len(json)
+    # only the row count is needed, which is in the file metadata
+    raw_json_path: Path = io_dir / f'{prefix}_raw_json.parquet'
+    game_count: int = get_step_row_count(raw_json_path)
 
     data_datetime = datetime(data_date.year,
                              data_date.month,
@@ -93,14 +90,9 @@ def fetch_lichess_api_pgn(player: str,
                                                format=PYCHESS,
                                                )
 
-    visitors: list[Type[Visitor]] = [EvalsVisitor,
-                                     ClocksVisitor,
-                                     QueenExchangeVisitor,
-                                     CastlingVisitor,
-                                     PromotionsVisitor,
-                                     PositionsVisitor,
-                                     MaterialVisitor,
-                                     ]
+    # a single visitor that does the work of all the others, so each game
+    # only gets replayed once
+    visitors: list[Type[Visitor]] = [GameVisitor]
 
     header_infos = []
 
@@ -120,4 +112,4 @@ def fetch_lichess_api_pgn(player: str,
               f'{counter} / {game_count} :: {current_progress:.2%}')
 
     df: pd.DataFrame = pd.DataFrame(header_infos)
-    df.to_parquet(io_dir / f'{prefix}_raw_pgn.parquet')
+    write_step_output(df, io_dir / f'{prefix}_raw_pgn.parquet')
@@ -0,0 +1,141 @@
+"""
+Concurrent lookups of positions in the lichess cloud evals.
+"""
+
+import asyncio
+import logging
+
+import requests
+from pipeline_import.transforms import parse_cloud_eval
+from requests.adapters import HTTPAdapter
+from utils.rate_budget import RateBudget
+
+LICHESS_CLOUD_EVAL_URL = 'https://lichess.org/api/cloud-eval'
+CLOUD_EVAL_MAX_IN_FLIGHT = 4
+# lichess asks clients to wait a full minute after being rate limited
+RATE_LIMIT_BACKOFF_SECONDS = 60
+REQUEST_TIMEOUT_SECONDS = 10
+
+
+class _CloudEvalFetcher:
+    """
+    Fetches cloud evals concurrently, sharing a backoff between requests.
+
+    Requests go through a pooled session and run on threads, with at most
+    `max_in_flight` of them at a time. A 429 response pauses every request,
+    not just the one that got it. If requests sent after the backoff are
+    still rate limited, the remaining lookups are given up on, so that
+    their positions go to the engines instead of waiting out more backoffs.
+    """
+
+    def __init__(self,
+                 session: requests.Session,
+                 budget: RateBudget,
+                 max_in_flight: int,
+                 ):
+        self.session = session
+        self.budget = budget
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._resume_at: float | None = None
+        self._stopped = False
+
+    async def _wait_for_backoff(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (self._resume_at is not None
+               and (delay := self._resume_at - loop.time()) > 0):
+            await asyncio.sleep(delay)
+
+    def _rate_limited(self, sent_at: float) -> None:
+        if self._resume_at is not None and sent_at >= self._resume_at:
+            if not self._stopped:
+                logging.warning('Still rate limited by the lichess API after '
+                                'backing off, giving up on the cloud evals')
+            self._stopped = True
+            return
+
+        logging.warning('Rate limited by the lichess API, '
+                        'pausing the cloud evals')
+        loop = asyncio.get_running_loop()
+        self._resume_at = max(self._resume_at or 0,
+                              loop.time() + RATE_LIMIT_BACKOFF_SECONDS,
+                              )
+
+    async def fetch(self, fen: str) -> float | None:
+        loop = asyncio.get_running_loop()
+
+        async with self._in_flight:
+            # a rate limited request is retried once after the backoff, and
+            # a second 429 stops every lookup
+            while not self._stopped:
+                await self._wait_for_backoff()
+                # don't spend tokens on requests that would be rate limited
+                if self._stopped:
+                    break
+                # reserving tokens can be a round trip to valkey, so keep it
+                # off the event loop like the requests
+                if not await asyncio.to_thread(self.budget.acquire):
+                    return None
+
+                sent_at: float = loop.time()
+                try:
+                    response = await asyncio.to_thread(
+                        self.session.get,
+                        LICHESS_CLOUD_EVAL_URL,
+                        params={'fen': fen, 'multiPv': 1},
+                        timeout=REQUEST_TIMEOUT_SECONDS,
+                    )
+                except requests.RequestException as e:
+                    logging.warning(f'Cloud eval request failed: {e}')
+                    return None
+
+                if response.status_code == 429:
+                    self._rate_limited(sent_at)
+                    continue
+
+                # positions that aren't in the cloud evals are a 404
+                if response.status_code != 200:
+                    return None
+
+                return parse_cloud_eval(fen=fen, cloud_eval=response.json())
+
+        return None
+
+
+async def _fetch_cloud_evals(fens: list[str],
+                             budget: RateBudget,
+                             max_in_flight: int,
+                             ) -> list[float | None]:
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        session.mount('https://', adapter)
+        fetcher = _CloudEvalFetcher(session=session,
+                                    budget=budget,
+                                    max_in_flight=max_in_flight,
+                                    )
+        return await asyncio.gather(*[fetcher.fetch(fen) for fen in fens])
+
+
+def get_cloud_evals(fens: list[str],
+                    budget: RateBudget,
+                    max_in_flight: int = CLOUD_EVAL_MAX_IN_FLIGHT,
+                    ) -> dict[str, float]:
+    """
+    Look up `fens` in the lichess cloud evals, with concurrent requests.
+
+    Every request takes a call from `budget`. Positions without a cloud
+    eval, or that couldn't be fetched within the budget or because lichess
+    kept rate limiting the requests, are left out.
+    """
+    if not fens:
+        return {}
+    if max_in_flight < 1:
+        raise ValueError('Max in-flight requests must be at least 1, '
+                         f'got {max_in_flight}')
+
+    evals = asyncio.run(_fetch_cloud_evals(fens=fens,
+                                           budget=budget,
+                                           max_in_flight=max_in_flight,
+                                           ))
+    return {fen: evaluation
+            for fen, evaluation in zip(fens, evals)
+            if evaluation is not None}
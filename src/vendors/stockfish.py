@@ -1,13 +1,159 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
 from datetime import date
+from functools import partial
 from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
 import valkey
+from more_itertools import chunked
 from pipeline_import.configs import get_cfg
-from pipeline_import.transforms import get_clean_fens, get_sf_evaluation
-from utils.db import run_remote_sql_query
-from utils.output import get_output_file_prefix
+from pipeline_import.transforms import (
+    REMOTE_EVAL_BATCH_SIZE,
+    StockfishPool,
+    get_clean_fens,
+    get_eval_budgets,
+    get_position_hashes,
+    get_remote_evals,
+    get_sf_evaluation,
+    is_terminal_position,
+)
+from utils.db import run_remote_sql_query, run_remote_sql_query_with_table
+from utils.eval_cache import EVAL_COLUMNS, EvalCache
+from utils.output import (
+    get_output_file_prefix,
+    read_step_input,
+    write_step_output,
+)
+from vendors.lichess_cloud_evals import (
+    CLOUD_EVAL_MAX_IN_FLIGHT,
+    get_cloud_evals,
+)
+
+
+# lookups of up to this many positions are sent as a single array parameter,
+# past this the positions are ingested into a temp table and joined on.
+# scripts/db_lookup_benchmark.py against a local postgres 16 with 200k stored
+# evals, half of the positions being hits (best of 3, in seconds):
+#
+#   positions      any   chunked   temp_table
+#       1_000    0.008     0.008        0.053
+#      10_000    0.125     0.166        0.179
+#      20_000    0.215     0.344        0.186
+#      50_000    0.213     0.786        0.219
+#     100_000    0.352     1.450        0.271
+#
+# chunked is never the fastest since it makes a round trip per chunk, so it
+# is only used when asked for
+ANY_LOOKUP_MAX_POSITIONS = 10_000
+DB_LOOKUP_CHUNK_SIZE = 5_000
+DB_LOOKUP_STRATEGIES = ['any', 'chunked', 'temp_table']
+
+
+def _choose_db_lookup_strategy(position_count: int) -> str:
+    if position_count <= ANY_LOOKUP_MAX_POSITIONS:
+        return 'any'
+    else:
+        return 'temp_table'
+
+
+def get_db_evaluations(positions: list[str],
+                       strategy: str | None = None,
+                       ) -> pd.DataFrame:
+    """
+    Get the evaluations already in `position_evals` for `positions`.
+
+    `strategy` is one of `DB_LOOKUP_STRATEGIES`. If not given, it is picked
+    based on how many positions there are to look up.
+    """
+    positions = list(dict.fromkeys(positions))
+    if not positions:
+        return pd.DataFrame([], columns=EVAL_COLUMNS)
+
+    if strategy is None:
+        strategy = _choose_db_lookup_strategy(len(positions))
+
+    any_sql: str = """SELECT fen, evaluation, eval_depth
+                      FROM position_evals
+                      WHERE fen = ANY(%(positions)s);
+                      """
+
+    start: float = time.perf_counter()
+
+    if strategy == 'any':
+        df = run_remote_sql_query(any_sql, positions=positions)
+    elif strategy == 'chunked':
+        df = pd.concat([run_remote_sql_query(any_sql, positions=chunk)
+                        for chunk in chunked(positions, DB_LOOKUP_CHUNK_SIZE)
+                        ],
+                       axis=0,
+                       ignore_index=True,
+                       )
+    elif strategy == 'temp_table':
+        join_sql: str = """SELECT position_evals.fen, evaluation, eval_depth
+                           FROM position_evals
+                           INNER JOIN temp_positions
+                             ON temp_positions.fen = position_evals.fen
+                           """
+        positions_table: pa.Table = pa.table({'fen': positions})
+        df = run_remote_sql_query_with_table(join_sql,
+                                             table_name='temp_positions',
+                                             table=positions_table,
+                                             )
+    else:
+        raise ValueError(f'Unknown db lookup strategy {strategy}, expected '
+                         f'one of {DB_LOOKUP_STRATEGIES}')
+
+    elapsed: float = time.perf_counter() - start
+    print(f'Looked up {len(positions)} positions in the db using {strategy=} '
+          f':: found {len(df)} :: took {elapsed:.2f}s')
+
+    return df
+
+
+def _get_positions_to_evaluate(positions: pd.Series,
+                               positions_evaluated: set[str],
+                               ) -> list[str]:
+    # the same positions show up across games (e.g. openings or
+    # transpositions), so only evaluate each one once. the set lookup keeps
+    # this linear in the number of positions no matter how many were already
+    # found in the db
+    return [position
+            for position in positions.drop_duplicates().tolist()
+            if position not in positions_evaluated
+            ]
+
+
+def _evaluate_position(position: str,
+                       sf_location: Path,
+                       sf_depth: int,
+                       sf_pool: StockfishPool,
+                       ) -> float:
+    # the cloud and remote evals were already tried for all the positions
+    # in bulk, so only evaluate locally
+    return get_sf_evaluation(position + ' 0',
+                             sf_location,
+                             sf_depth,
+                             lichess_budget=None,
+                             remote_budget=None,
+                             sf_pool=sf_pool,
+                             )
+
+
+def get_stockfish_pool(eval_workers: int = 1) -> StockfishPool:
+    """
+    Create a pool of local engines from the stockfish config.
+    """
+    sf_params = get_cfg('stockfish_cfg')
+    # each worker needs its own engine, so the pool can't be smaller
+    pool_size: int = max(int(sf_params.get('pool_size', 1)), eval_workers)
+    return StockfishPool(sf_location=Path(sf_params['location']),
+                         sf_depth=int(sf_params['depth']),
+                         size=pool_size,
+                         )
 
 
 def get_evals(player: str,
@@ -15,20 +161,22 @@ def get_evals(player: str,
               data_date: date,
               local_stockfish: bool,
               io_dir: Path,
+              eval_workers: int = 1,
+              sf_pool: StockfishPool | None = None,
               ) -> None:
     prefix: str = get_output_file_prefix(player=player,
                                          perf_type=perf_type,
                                          data_date=data_date,
                                          )
-    df = pd.read_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+    df = read_step_input(io_dir / f'{prefix}_cleaned_df.parquet',
+                         columns=['evaluations', 'eval_depths', 'positions'],
+                         )
     if df.empty:
-        df.to_parquet(io_dir / f'{prefix}_evals.parquet')
+        write_step_output(df, io_dir / f'{prefix}_evals.parquet')
         return
 
     sf_params = get_cfg('stockfish_cfg')
 
-    df = df[['evaluations', 'eval_depths', 'positions']]
-
     # explode the two different list-likes separately, then concat
     no_evals: pd.DataFrame = df[~df['evaluations'].map(any)]
     df = df[df['evaluations'].map(any)]
@@ -41,53 +189,146 @@ def get_evals(player: str,
     positions: pd.Series = df['positions'].explode().reset_index(drop=True)
     positions = get_clean_fens(positions)
 
-    sql: str = """SELECT fen, evaluation, eval_depth
-                  FROM position_evals
-                  WHERE fen IN %(positions)s;
-                  """
-    db_evaluations = run_remote_sql_query(sql,
-                                          positions=tuple(positions.tolist() + no_evals['positions'].tolist()),  # noqa
-                                          )
-    positions_evaluated = db_evaluations['fen'].drop_duplicates()
+    all_positions: list[str] = (positions.tolist()
+                                + no_evals['positions'].tolist())
+
+    cache_size: int = int(sf_params.get('cache_size', 0))
+
+    if local_stockfish or cache_size:
+        valkey_url: str = os.environ['VALKEY_CONNECTION_URL']
+        valkey_client: valkey.Valkey = valkey.from_url(valkey_url,
+                                                       decode_responses=True,
+                                                       )
+
+    eval_cache: EvalCache | None = None
+    cached_evaluations = pd.DataFrame([], columns=EVAL_COLUMNS)
+    if cache_size:
+        eval_cache = EvalCache(valkey_client=valkey_client,
+                               max_size=cache_size,
+                               )
+
+        # check the local cache first so we only query the db for misses
+        cached_evaluations = eval_cache.get_many(
+            list(set(all_positions)),
+            min_depth=int(sf_params['depth']),
+        )
+        cache_hits: set[str] = set(cached_evaluations['fen'])
+        all_positions = [position
+                         for position in all_positions
+                         if position not in cache_hits
+                         ]
+        print(f'Found {len(cache_hits)} positions in the eval cache')
+
+    db_evaluations = get_db_evaluations(
+        all_positions,
+        strategy=sf_params.get('db_lookup_strategy'),
+    )
+
+    if db_evaluations.empty:
+        db_evaluations = cached_evaluations
+    elif not cached_evaluations.empty:
+        db_evaluations = pd.concat([cached_evaluations, db_evaluations],
+                                   axis=0,
+                                   ignore_index=True,
+                                   )
+
+    positions_evaluated: set[str] = set(db_evaluations['fen'])
 
     df = pd.concat([positions, evals, depths], axis=1)
 
     if local_stockfish:
 
-        local_evals: list[float | None] = []
+        unique_positions: list[str] = _get_positions_to_evaluate(
+            no_evals['positions'],
+            positions_evaluated,
+        )
 
-        counter: int = 0
-        position_count: int = len(no_evals['positions'])
-        evaluation: float | None = None
+        position_count: int = len(unique_positions)
+        print(f'Skipping {len(no_evals) - position_count} duplicate or '
+              'already evaluated positions')
 
-        valkey_url: str = os.environ['VALKEY_CONNECTION_URL']
-        valkey_client: valkey.Valkey = valkey.from_url(valkey_url,
-                                                       decode_responses=True,
-                                                       )
+        # engines from a pool passed in by the caller outlive this step
+        pool_context: AbstractContextManager = nullcontext()
+        if sf_pool is None:
+            sf_pool = get_stockfish_pool(eval_workers)
+            pool_context = sf_pool
+
+        # the budgets are shared by all workers, and give back the calls
+        # they reserved but didn't make once the positions are evaluated
+        lichess_budget, remote_budget = get_eval_budgets(valkey_client)
+
+        evaluate = partial(_evaluate_position,
+                           sf_location=Path(sf_params['location']),
+                           sf_depth=int(sf_params['depth']),
+                           sf_pool=sf_pool,
+                           )
+        get_remote_batch_evals = partial(get_remote_evals,
+                                         remote_budget=remote_budget,
+                                         )
+        max_in_flight: int = int(sf_params.get('cloud_eval_max_in_flight',
+                                               CLOUD_EVAL_MAX_IN_FLIGHT,
+                                               ))
 
-        for position in no_evals['positions'].tolist():
-            if position in positions_evaluated.values:
-                # position will be dropped later if evaluation is None
-                evaluation = None
-            else:
-                evaluation = get_sf_evaluation(position + ' 0',
-                                               Path(sf_params['location']),
-                                               int(sf_params['depth']),
-                                               valkey_client,
-                                               )
+        # the engines run in subprocesses and the remote evals are network
+        # bound, so threads are enough to keep all the workers busy.
+        # results are yielded in the original order of the positions
+        with (pool_context,
+              lichess_budget,
+              remote_budget,
+              ThreadPoolExecutor(eval_workers) as executor):
+            # terminal positions are rated without asking any engine
+            lookup_fens: list[str] = [
+                position + ' 0'
+                for position in unique_positions
+                if not is_terminal_position(position + ' 0')
+            ]
 
-            local_evals.append(evaluation)
+            # the cloud evals are latency bound, so look them all up
+            # concurrently before asking any engine
+            cloud_evals: dict[str, float] = get_cloud_evals(
+                lookup_fens,
+                lichess_budget,
+                max_in_flight=max_in_flight,
+            )
+            print(f'Found {len(cloud_evals)} positions in the cloud evals')
 
-            # progress bar stuff
-            counter += 1
+            # each call to the remote engine evaluates a batch of positions
+            remote_batches = chunked([fen for fen in lookup_fens
+                                      if fen not in cloud_evals],
+                                     REMOTE_EVAL_BATCH_SIZE,
+                                     )
+            remote_evals: dict[str, float] = {}
+            for batch_evals in executor.map(get_remote_batch_evals,
+                                            remote_batches,
+                                            ):
+                remote_evals.update(batch_evals)
+            print(f'Evaluated {len(remote_evals)} positions remotely')
 
-            current_progress = counter / position_count
-            print(f'Analyzed :: {counter} / {position_count} '
-                  f':: {current_progress:.2%}')
+            local_evals: dict[str, float] = {
+                fen.removesuffix(' 0'): evaluation
+                for fen, evaluation in (cloud_evals | remote_evals).items()
+            }
+
+            counter: int = len(local_evals)
+            remaining_positions: list[str] = [
+                position
+                for position in unique_positions
+                if position not in local_evals
+            ]
+            evaluations = executor.map(evaluate, remaining_positions)
+            for position, evaluation in zip(remaining_positions, evaluations):
+                local_evals[position] = evaluation
+
+                # progress bar stuff
+                counter += 1
+
+                current_progress = counter / position_count
+                print(f'Analyzed :: {counter} / {position_count} '
+                      f':: {current_progress:.2%}')
 
         print(f'Analyzed all {position_count} positions')
 
-        no_evals['evaluations'] = local_evals
+        no_evals['evaluations'] = no_evals['positions'].map(local_evals)
         no_evals['eval_depths'] = sf_params['depth']
         no_evals.dropna(inplace=True)
 
@@ -108,4 +349,12 @@ def get_evals(player: str,
     if not db_evaluations.empty:
         df = pd.concat([df, db_evaluations], axis=0, ignore_index=True)
 
-    df.to_parquet(io_dir / f'{prefix}_evals.parquet')
+    # positions can show up in several games, but position_evals only
+    # holds one evaluation per position
+    df = df.drop_duplicates(subset='fen', ignore_index=True)
+    df['fen_hash'] = get_position_hashes(df['fen'])
+
+    if eval_cache is not None:
+        eval_cache.set_many(df)
+
+    write_step_output(df, io_dir / f'{prefix}_evals.parquet')
@@ -0,0 +1,151 @@
+import importlib.util
+import json
+import shutil
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+HANDLER_PATH = Path(__file__).parents[2] / 'cloud_function' / 'handler.py'
+# the stockfish binary built into the dev image, if there is one
+STOCKFISH_PATH = shutil.which('stockfish') or '/stockfish'
+
+FENS = ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+        'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+        '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1',
+        ]
+
+
+class FakeProcess:
+    def __init__(self):
+        self.returncode = None
+        # exited without the health check having noticed yet
+        self.broken = False
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class FakeStockfish:
+    instances = []
+
+    def __init__(self, path, depth):
+        self.depth = depth
+        self.fen = None
+        self.stockfish = FakeProcess()
+        FakeStockfish.instances.append(self)
+
+    def set_fen_position(self, fen):
+        if self.stockfish.broken:
+            raise BrokenPipeError
+        self.fen = fen
+
+    def get_best_move(self):
+        score = sum(map(ord, self.fen)) % 200 - 100
+        self.info = f'info depth {self.depth} score cp {score}'
+
+
+@pytest.fixture
+def fake_stockfish(monkeypatch):
+    monkeypatch.setattr(FakeStockfish, 'instances', [])
+    return FakeStockfish
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setitem(sys.modules,
+                        '_version',
+                        types.SimpleNamespace(__version__='abc1234'),
+                        )
+    spec = importlib.util.spec_from_file_location('handler', HANDLER_PATH)
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+    return handler
+
+
+def invoke(handler, body):
+    response = handler.handle({'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def assert_batch_matches_single(handler):
+    single_results = []
+    for fen in FENS:
+        status, body = invoke(handler, {'fen': fen})
+        assert status == 200
+        single_results.append(body['result'])
+
+    status, body = invoke(handler, {'fens': FENS})
+
+    assert status == 200
+    assert body['results'] == single_results
+    assert body['depth'] == handler.DEPTH
+    assert body['cloud_function_version'] == 'abc1234'
+
+
+def test_handle_batch_matches_single(handler, monkeypatch, fake_stockfish):
+    monkeypatch.setattr(handler.stockfish, 'Stockfish', fake_stockfish)
+
+    assert_batch_matches_single(handler)
+
+
+@pytest.mark.skipif(not Path(STOCKFISH_PATH).exists(),
+                    reason='needs a stockfish binary')
+def test_handle_batch_matches_single_stockfish(handler, monkeypatch):
+    monkeypatch.setattr(handler, 'STOCKFISH_PATH', STOCKFISH_PATH)
+    # searches are deterministic for a fixed depth, keep it quick
+    monkeypatch.setattr(handler, 'DEPTH', 10)
+
+    assert_batch_matches_single(handler)
+
+
+@pytest.mark.parametrize('fens', ['not a list', FENS * 50])
+def test_handle_invalid_batch(handler, monkeypatch, fake_stockfish, fens):
+    monkeypatch.setattr(handler.stockfish, 'Stockfish', fake_stockfish)
+
+    status, body = invoke(handler, {'fens': fens})
+
+    assert status == 400
+    assert 'error' in body
+
+
+def test_handle_reuses_engine(handler, monkeypatch, fake_stockfish):
+    monkeypatch.setattr(handler.stockfish, 'Stockfish', fake_stockfish)
+
+    _, cold = invoke(handler, {'fens': FENS})
+    _, warm = invoke(handler, {'fen': FENS[0]})
+
+    assert len(fake_stockfish.instances) == 1
+    assert cold['engine_start_time'] > 0
+    assert warm['engine_start_time'] == 0
+    assert warm['search_time'] > 0
+
+
+def test_handle_respawns_dead_engine(handler, monkeypatch, fake_stockfish):
+    monkeypatch.setattr(handler.stockfish, 'Stockfish', fake_stockfish)
+
+    _, first = invoke(handler, {'fen': FENS[0]})
+    # the health check notices the process is gone
+    fake_stockfish.instances[0].stockfish.kill()
+    _, second = invoke(handler, {'fen': FENS[0]})
+
+    assert len(fake_stockfish.instances) == 2
+    assert second['engine_start_time'] > 0
+    assert second['result'] == first['result']
+
+
+def test_handle_retries_on_broken_engine(handler, monkeypatch, fake_stockfish):
+    monkeypatch.setattr(handler.stockfish, 'Stockfish', fake_stockfish)
+
+    _, first = invoke(handler, {'fen': FENS[0]})
+    fake_stockfish.instances[0].stockfish.broken = True
+    status, second = invoke(handler, {'fen': FENS[0]})
+
+    assert status == 200
+    assert len(fake_stockfish.instances) == 2
+    assert fake_stockfish.instances[0].stockfish.poll() is not None
+    assert second['result'] == first['result']
@@ -1,7 +1,26 @@
+import os
+
 import lichess.api
 import pytest
 
 
+def pytest_configure(config):
+    config.addinivalue_line('markers',
+                            'benchmark: timing comparisons, only run with '
+                            'RUN_BENCHMARKS=1',
+                            )
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get('RUN_BENCHMARKS'):
+        return
+
+    skip_benchmark = pytest.mark.skip(reason='set RUN_BENCHMARKS=1 to run')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture
 def mocked_cloud_eval(mocker):
     mocker.patch('lichess.api.cloud_eval',
@@ -0,0 +1,74 @@
+import configparser
+
+import pytest
+from pipeline_import import configs
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    path = tmp_path / 'config.toml'
+    path.write_text('[postgres_cfg]\n'
+                    'host = localhost\n'
+                    'port = 5432\n'
+                    '\n'
+                    '[remote_eval]\n'
+                    'REMOTE_EVAL_URL = https://eval.com\n'
+                    )
+    monkeypatch.setattr(configs, 'CONFIG_PATH', str(path))
+    configs.reload_cfg()
+    yield path
+    configs.reload_cfg()
+
+
+def test_get_cfg(config_path):
+    pg_cfg = configs.get_cfg('postgres_cfg')
+
+    assert dict(pg_cfg) == {'host': 'localhost', 'port': '5432'}
+    assert pg_cfg.get('user') is None
+    # option names are case insensitive, like in configparser
+    assert configs.get_cfg('remote_eval')['REMOTE_EVAL_URL'] == (
+        'https://eval.com'
+    )
+    with pytest.raises(KeyError):
+        configs.get_cfg('lichess')
+    with pytest.raises(TypeError):
+        pg_cfg['host'] = 'db'
+
+
+def test_get_cfg_is_cached(config_path):
+    assert configs.get_cfg('postgres_cfg')['host'] == 'localhost'
+
+    config_path.write_text('[postgres_cfg]\nhost = db\n')
+    assert configs.get_cfg('postgres_cfg')['host'] == 'localhost'
+
+    configs.reload_cfg()
+    assert configs.get_cfg('postgres_cfg')['host'] == 'db'
+
+
+def test_get_cfg_env_overrides(config_path, monkeypatch):
+    monkeypatch.setenv('CHESS_PIPELINE__POSTGRES_CFG__HOST', 'db')
+    monkeypatch.setenv('CHESS_PIPELINE__LICHESS__TOKEN', 'abc')
+    monkeypatch.setenv('CHESS_PIPELINE__LICHESS', 'ignored')
+    configs.reload_cfg()
+
+    assert dict(configs.get_cfg('postgres_cfg')) == {'host': 'db',
+                                                     'port': '5432',
+                                                     }
+    assert dict(configs.get_cfg('lichess')) == {'token': 'abc'}
+
+
+def test_get_cfg_interpolates_lazily(config_path):
+    config_path.write_text('[stockfish_cfg]\n'
+                           'dir = /opt\n'
+                           'location = %(dir)s/stockfish\n'
+                           'depth = %(missing)s\n'
+                           )
+    configs.reload_cfg()
+
+    sf_cfg = configs.get_cfg('stockfish_cfg')
+
+    # only reading the broken option fails
+    assert sf_cfg['location'] == '/opt/stockfish'
+    assert list(sf_cfg) == ['dir', 'location', 'depth']
+    with pytest.raises(configparser.InterpolationMissingOptionError):
+        sf_cfg['depth']
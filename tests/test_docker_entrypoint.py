@@ -0,0 +1,298 @@
+import re
+import subprocess
+import sys
+from collections.abc import Iterable
+from concurrent.futures import Executor, Future
+from datetime import date
+from pathlib import Path
+
+import docker_entrypoint
+import pandas as pd
+import pytest
+from utils.output import get_output_file_prefix
+
+
+def test_get_data_dates():
+    assert docker_entrypoint.get_data_dates(date(2024, 2, 27), None) == [
+        date(2024, 2, 27),
+    ]
+    assert docker_entrypoint.get_data_dates(date(2024, 2, 27),
+                                            date(2024, 3, 1),
+                                            ) == [date(2024, 2, 27),
+                                                  date(2024, 2, 28),
+                                                  date(2024, 2, 29),
+                                                  date(2024, 3, 1),
+                                                  ]
+
+    with pytest.raises(ValueError):
+        docker_entrypoint.get_data_dates(date(2024, 3, 1), date(2024, 2, 1))
+
+
+def test_run_steps(mocker, tmp_path):
+    calls = []
+
+    def record(name):
+        def step(player, perf_type, data_date, local_stockfish, io_dir,
+                 **kwargs):
+            calls.append((name, player, perf_type, data_date, kwargs))
+        return step
+
+    mocker.patch.object(docker_entrypoint, 'load_step', side_effect=record)
+    sf_pool = mocker.MagicMock()
+    get_stockfish_pool = mocker.patch('vendors.stockfish.get_stockfish_pool',
+                                      return_value=sf_pool,
+                                      )
+
+    docker_entrypoint.run_steps(steps=['clean_df', 'get_evals'],
+                                players=['thibault', 'DrNykterstein'],
+                                perf_types=['bullet'],
+                                data_dates=[date(2024, 1, 1),
+                                            date(2024, 1, 2),
+                                            ],
+                                local_stockfish=True,
+                                io_dir=tmp_path,
+                                eval_workers=2,
+                                )
+
+    # every step runs for each player-day, in order
+    assert [call[:4] for call in calls] == [
+        ('clean_df', 'thibault', 'bullet', date(2024, 1, 1)),
+        ('get_evals', 'thibault', 'bullet', date(2024, 1, 1)),
+        ('clean_df', 'DrNykterstein', 'bullet', date(2024, 1, 1)),
+        ('get_evals', 'DrNykterstein', 'bullet', date(2024, 1, 1)),
+        ('clean_df', 'thibault', 'bullet', date(2024, 1, 2)),
+        ('get_evals', 'thibault', 'bullet', date(2024, 1, 2)),
+        ('clean_df', 'DrNykterstein', 'bullet', date(2024, 1, 2)),
+        ('get_evals', 'DrNykterstein', 'bullet', date(2024, 1, 2)),
+    ]
+    # a single engine pool is shared by all the get_evals runs
+    get_stockfish_pool.assert_called_once_with(2)
+    assert all(call[4] == {'eval_workers': 2, 'sf_pool': sf_pool}
+               for call in calls if call[0] == 'get_evals')
+    assert all(call[4] == {} for call in calls if call[0] == 'clean_df')
+    sf_pool.__exit__.assert_called_once()
+
+
+def test_order_steps():
+    steps = ['load_move_list', 'get_win_probs', 'explode_all', 'clean_df']
+
+    ordered = docker_entrypoint.order_steps(steps)
+
+    assert sorted(ordered) == sorted(steps)
+    assert ordered.index('clean_df') < ordered.index('explode_all')
+    assert ordered.index('explode_all') < ordered.index('load_move_list')
+    assert ordered.index('explode_all') < ordered.index('get_win_probs')
+
+
+def test_step_files_cover_all_steps():
+    steps = set(docker_entrypoint.ETL_STEPS)
+
+    assert set(docker_entrypoint.STEP_INPUTS) == steps
+    assert set(docker_entrypoint.STEP_OUTPUTS) == steps
+
+
+def test_run_steps_in_memory(tmp_path):
+    data_date = date(2025, 1, 1)
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=data_date,
+                                         )
+    material = [8, 2, 2, 2, 1, 8, 2, 2, 2, 1]
+    pd.DataFrame(
+        [['https://fake-link.com/abc',
+          ['e4'],
+          ['0:01:00'],
+          ['rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'],
+          [material],
+          ]],
+        columns=['game_link',
+                 'moves',
+                 'clocks',
+                 'positions',
+                 'material_by_move',
+                 ],
+    ).to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+
+    docker_entrypoint.run_steps(steps=['explode_all'],
+                                players=['test'],
+                                perf_types=['bullet'],
+                                data_dates=[data_date],
+                                local_stockfish=False,
+                                io_dir=tmp_path,
+                                in_memory=True,
+                                checkpoints=['exploded_moves'],
+                                )
+
+    assert (tmp_path / f'{prefix}_exploded_moves.parquet').exists()
+    assert not (tmp_path / f'{prefix}_exploded_clocks.parquet').exists()
+
+
+def test_run_steps_concurrently(tmp_path):
+    data_date = date(2025, 1, 1)
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=data_date,
+                                         )
+    material = [8, 2, 2, 2, 1, 8, 2, 2, 2, 1]
+    cleaned_df = pd.DataFrame(
+        [['https://fake-link.com/abc',
+          ['e4'],
+          ['0:01:00'],
+          ['rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'],
+          [material],
+          ]],
+        columns=['game_link',
+                 'moves',
+                 'clocks',
+                 'positions',
+                 'material_by_move',
+                 ],
+    )
+    steps = ['explode_moves',
+             'explode_clocks',
+             'explode_positions',
+             'explode_materials',
+             ]
+    outputs = ['exploded_moves',
+               'exploded_clocks',
+               'exploded_positions',
+               'exploded_materials',
+               ]
+
+    serial_dir = tmp_path / 'serial'
+    parallel_dir = tmp_path / 'parallel'
+    for io_dir, max_parallel in [(serial_dir, 1), (parallel_dir, 3)]:
+        io_dir.mkdir()
+        cleaned_df.to_parquet(io_dir / f'{prefix}_cleaned_df.parquet')
+        docker_entrypoint.run_steps(steps=steps,
+                                    players=['test'],
+                                    perf_types=['bullet'],
+                                    data_dates=[data_date],
+                                    local_stockfish=False,
+                                    io_dir=io_dir,
+                                    max_parallel=max_parallel,
+                                    )
+
+    for output in outputs:
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(parallel_dir / f'{prefix}_{output}.parquet'),
+            pd.read_parquet(serial_dir / f'{prefix}_{output}.parquet'),
+        )
+
+
+def test_run_steps_concurrently_follows_dependencies(monkeypatch, tmp_path):
+    finished: list[str] = []
+
+    class InlineExecutor(Executor):
+        # runs each step when it is submitted, so the order is observable
+        def submit(self, fn, /, *args, **kwargs):
+            future = Future()
+            fn(*args, **kwargs)
+            finished.append(args[0])
+            future.set_result(None)
+            return future
+
+    steps = ['load_win_probs', 'get_win_probs', 'explode_all', 'get_evals',
+             'get_game_infos', 'clean_df']
+
+    monkeypatch.setattr(docker_entrypoint,
+                        'load_step',
+                        lambda step: (lambda **kwargs: None),
+                        )
+    docker_entrypoint.run_steps_concurrently(InlineExecutor(),
+                                             steps,
+                                             {},
+                                             player='test',
+                                             perf_type='bullet',
+                                             data_date=date(2025, 1, 1),
+                                             local_stockfish=False,
+                                             io_dir=tmp_path,
+                                             )
+
+    assert sorted(finished) == sorted(steps)
+    assert finished[0] == 'clean_df'
+    assert finished[-2:] == ['get_win_probs', 'load_win_probs']
+
+
+def test_run_steps_in_memory_needs_serial_run(tmp_path):
+    with pytest.raises(ValueError):
+        docker_entrypoint.run_steps(steps=['explode_all'],
+                                    players=['test'],
+                                    perf_types=['bullet'],
+                                    data_dates=[date(2025, 1, 1)],
+                                    local_stockfish=False,
+                                    io_dir=tmp_path,
+                                    in_memory=True,
+                                    max_parallel=2,
+                                    )
+
+
+# the heavy packages each step module needs. a step importing more than that
+# pays for the startup of steps it doesn't run
+HEAVY_PACKAGES = {'adbc_driver_postgresql', 'chess', 'lichess', 'pandas',
+                  'requests', 'sklearn', 'sqlalchemy', 'stockfish', 'valkey',
+                  }
+STEP_HEAVY_PACKAGES = {
+    'fetch_json': {'chess', 'lichess', 'pandas', 'requests'},
+    'clean_df': {'chess', 'pandas'},
+    'get_evals': {'adbc_driver_postgresql', 'chess', 'pandas', 'sqlalchemy',
+                  'requests', 'valkey',
+                  },
+    'get_game_infos': {'chess', 'pandas'},
+    'get_win_probs': {'chess', 'pandas'},
+    'load_move_list': {'adbc_driver_postgresql', 'pandas'},
+}
+# startup time of a step on top of importing the packages it needs. loading
+# the pipeline's own modules takes well under 100ms
+STEP_STARTUP_BUDGET_US = 250_000
+
+
+def load_steps(*steps: str,
+               preload: Iterable[str] = (),
+               ) -> tuple[int, set[str]]:
+    """
+    Load `steps` in a fresh interpreter, after importing `preload`.
+
+    Returns the time it took to load the steps in microseconds, as reported
+    by `-X importtime`, and the heavy packages imported by then.
+    """
+    code = ('import importlib, sys\n'
+            f'for package in {sorted(preload)}:\n'
+            '    importlib.import_module(package)\n'
+            'print("-- loading steps --", file=sys.stderr)\n'
+            'import docker_entrypoint\n'
+            f'for step in {list(steps)}:\n'
+            '    docker_entrypoint.load_step(step)\n'
+            f'print(*{sorted(HEAVY_PACKAGES)} & sys.modules.keys())\n'
+            )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=Path(docker_entrypoint.__file__).parent,
+                            capture_output=True,
+                            text=True,
+                            check=True,
+                            )
+    stderr = result.stderr.split('-- loading steps --\n')[1]
+    # lines look like `import time: self [us] | cumulative | imported package`
+    # with nested imports indented, so only sum the top level ones
+    import_time = 0
+    for line in stderr.splitlines():
+        _, self_time, cumulative, name = re.split(r':|\|', line)
+        if self_time.strip().isdigit() and not name.startswith('  '):
+            import_time += int(cumulative)
+    return import_time, set(result.stdout.split())
+
+
+def test_entrypoint_imports_no_step():
+    _, packages = load_steps()
+
+    assert packages == set()
+
+
+@pytest.mark.parametrize('step', STEP_HEAVY_PACKAGES)
+def test_step_startup_time(step):
+    required = STEP_HEAVY_PACKAGES[step]
+
+    import_time, packages = load_steps(step, preload=required)
+
+    assert packages == required
+    assert import_time < STEP_STARTUP_BUDGET_US
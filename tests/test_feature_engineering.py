@@ -1,16 +1,26 @@
 #! /usr/bin/env python3
 
 
+import time
+import timeit
 from collections import Counter
 from datetime import date
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import feature_engineering
 from feature_engineering import (
+    MATERIAL_COLUMNS,
     clean_chess_df,
+    explode_all,
     explode_clocks,
     explode_materials,
     explode_moves,
     explode_positions,
+    get_material_counts,
 )
 from utils.output import get_output_file_prefix
 
@@ -227,14 +237,40 @@ def test_explode_positions(tmp_path, snapshot):
     assert df.reset_index(drop=True).to_json() == snapshot
 
 
+def test_explode_positions_game_without_moves(tmp_path):
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+    fen = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+    # e.g. a game that was aborted before the first move
+    input_df = pd.DataFrame([['https://fake-link.com/abc', [fen]],
+                             ['https://fake-link.com/def', []],
+                             ],
+                            columns=['game_link', 'positions'])
+    input_df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+
+    explode_positions(player='test',
+                      perf_type='bullet',
+                      data_date=date(2025, 1, 1),
+                      local_stockfish=True,
+                      io_dir=tmp_path,
+                      )
+    df = pd.read_parquet(tmp_path / f'{prefix}_exploded_positions.parquet')
+
+    assert df['fen_hash'].dtype == 'Int64'
+    assert df['fen'].tolist() == [fen[:-2], None]
+    assert df['fen_hash'].notna().tolist() == [True, False]
+
+
 def test_explode_materials(tmp_path, snapshot):
     prefix: str = get_output_file_prefix(player='test',
                                          perf_type='bullet',
                                          data_date=date(2025, 1, 1),
                                          )
     input_df = pd.DataFrame([['https://fake-link.com/abc',
-                              [{k: idx for idx, k in enumerate('prnbqPRNBQ')},
-                               {k: idx for idx, k in enumerate('rnbqPRNBQp')},
+                              [list(range(10)),
+                               list(range(1, 11)),
                                ]
                               ]],
                             columns=['game_link', 'material_by_move'])
@@ -248,3 +284,195 @@ def test_explode_materials(tmp_path, snapshot):
                       )
     df = pd.read_parquet(tmp_path / f'{prefix}_exploded_materials.parquet')
     assert df.reset_index(drop=True).to_json() == snapshot
+
+
+def test_get_material_counts_legacy_dicts():
+    counts = [[8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+              [8, 2, 2, 2, 1, 7, 2, 0, 2, 1],
+              ]
+    legacy = pd.Series([dict(zip('PNBRQpnbrq', row)) for row in counts],
+                       index=[3, 3],
+                       )
+    # pieces that are gone were simply missing from the old Counters
+    del legacy.iloc[1]['b']
+
+    df = get_material_counts(legacy)
+    expected = get_material_counts(pd.Series(counts, index=[3, 3]))
+
+    pd.testing.assert_frame_equal(df, expected)
+    assert (df.dtypes == np.int8).all()
+
+
+def _get_material_corpus(size: int):
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 9, size=(size, 10))
+    materials = pd.Series(list(counts))
+    legacy = pd.Series([dict(zip('PNBRQpnbrq', row.tolist()))
+                        for row in counts])
+    return materials, legacy
+
+
+def _get_material_counts_with_apply(legacy: pd.Series) -> pd.DataFrame:
+    return (legacy.apply(pd.Series)
+                  .fillna(0)
+                  .astype(int)
+                  .rename(columns=MATERIAL_COLUMNS))
+
+
+def test_get_material_counts_matches_apply():
+    materials, legacy = _get_material_corpus(1_000)
+
+    expected = _get_material_counts_with_apply(legacy).astype(np.int8)
+
+    pd.testing.assert_frame_equal(get_material_counts(materials), expected)
+    pd.testing.assert_frame_equal(get_material_counts(legacy), expected)
+
+
+@pytest.mark.benchmark
+def test_get_material_counts_benchmark():
+    materials, legacy = _get_material_corpus(100_000)
+
+    # the apply path takes seconds, so it's only timed once
+    start = time.perf_counter()
+    expected = _get_material_counts_with_apply(legacy)
+    old = time.perf_counter() - start
+
+    new = min(timeit.repeat(lambda: get_material_counts(materials),
+                            repeat=3,
+                            number=1,
+                            ))
+    legacy_new = min(timeit.repeat(lambda: get_material_counts(legacy),
+                                   repeat=3,
+                                   number=1,
+                                   ))
+    print(f'{len(materials)} half moves :: apply {old:.4f}s :: '
+          f'arrays {new:.4f}s :: dicts {legacy_new:.4f}s')
+
+    pd.testing.assert_frame_equal(get_material_counts(materials),
+                                  expected.astype(np.int8),
+                                  )
+    assert new < old
+    assert legacy_new < old
+
+
+def test_explode_all_matches_single_steps(mocker, tmp_path):
+    data_date = date(2025, 1, 1)
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=data_date,
+                                         )
+    start = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+    e4 = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+    material = [8, 2, 2, 2, 1, 8, 2, 2, 2, 1]
+    input_df = pd.DataFrame(
+        [['https://fake-link.com/abc',
+          'extra',
+          ['e4'],
+          ['0:01:00'],
+          [start, e4],
+          [material, material],
+          ],
+         ['https://fake-link.com/def',
+          'extra',
+          [],
+          [],
+          [start],
+          [material],
+          ],
+         ],
+        columns=['game_link',
+                 'unused',
+                 'moves',
+                 'clocks',
+                 'positions',
+                 'material_by_move',
+                 ])
+    input_df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    outputs = ['exploded_moves',
+               'exploded_clocks',
+               'exploded_positions',
+               'exploded_materials',
+               ]
+
+    for step in [explode_moves,
+                 explode_clocks,
+                 explode_positions,
+                 explode_materials,
+                 ]:
+        step(player='test',
+             perf_type='bullet',
+             data_date=data_date,
+             local_stockfish=True,
+             io_dir=tmp_path,
+             )
+    expected = {output: pd.read_parquet(tmp_path
+                                        / f'{prefix}_{output}.parquet')
+                for output in outputs}
+
+    fused_dir = tmp_path / 'fused'
+    fused_dir.mkdir()
+    input_df.to_parquet(fused_dir / f'{prefix}_cleaned_df.parquet')
+    number_half_moves = mocker.spy(feature_engineering,
+                                   'get_half_moves_from_lengths',
+                                   )
+    explode_all(player='test',
+                perf_type='bullet',
+                data_date=data_date,
+                local_stockfish=True,
+                io_dir=fused_dir,
+                )
+
+    for output in outputs:
+        df = pd.read_parquet(fused_dir / f'{prefix}_{output}.parquet')
+        pd.testing.assert_frame_equal(df, expected[output])
+    # the moves and clocks share their numbers, as do the positions and
+    # materials
+    assert number_half_moves.call_count == 2
+
+
+def test_explode_all_empty(tmp_path):
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+    pd.DataFrame().to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+
+    explode_all(player='test',
+                perf_type='bullet',
+                data_date=date(2025, 1, 1),
+                local_stockfish=True,
+                io_dir=tmp_path,
+                )
+
+    for output in ['moves', 'clocks', 'positions', 'materials']:
+        df = pd.read_parquet(tmp_path / f'{prefix}_exploded_{output}.parquet')
+        assert df.empty
+
+
+def test_explode_game_link_is_categorical(tmp_path):
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+    input_df = pd.DataFrame([['https://fake-link.com/abc', ['e4', 'c5']],
+                             ['https://fake-link.com/def', ['d4']],
+                             ],
+                            columns=['game_link', 'moves'])
+    input_df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+
+    explode_moves(player='test',
+                  perf_type='bullet',
+                  data_date=date(2025, 1, 1),
+                  local_stockfish=True,
+                  io_dir=tmp_path,
+                  )
+    path = tmp_path / f'{prefix}_exploded_moves.parquet'
+    df = pd.read_parquet(path)
+
+    assert isinstance(df['game_link'].dtype, pd.CategoricalDtype)
+    assert df['game_link'].astype(str).tolist() == [
+        'https://fake-link.com/abc',
+        'https://fake-link.com/abc',
+        'https://fake-link.com/def',
+    ]
+    assert pa.types.is_dictionary(pq.read_schema(path).field('game_link').type)
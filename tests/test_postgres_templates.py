@@ -0,0 +1,48 @@
+import pandas as pd
+import pyarrow as pa
+from pipeline_import.postgres_templates import (
+    _decode_dictionaries,
+    _get_insert_sql,
+)
+
+
+def test_decode_dictionaries():
+    df = pd.DataFrame({'game_link': pd.Categorical(['abc', 'abc', 'def']),
+                       'half_move': [1, 2, 1],
+                       })
+    batch = pa.RecordBatch.from_pandas(df, preserve_index=False)
+    assert pa.types.is_dictionary(batch.schema.field('game_link').type)
+
+    decoded = _decode_dictionaries(batch)
+
+    assert decoded.schema.field('game_link').type == pa.string()
+    assert decoded.column('game_link').to_pylist() == ['abc', 'abc', 'def']
+    assert decoded.column('half_move').to_pylist() == [1, 2, 1]
+
+
+def test_get_insert_sql():
+    sql = _get_insert_sql(table_name='game_moves',
+                          temp_table_name='temp_game_moves',
+                          id_cols=['game_link', 'half_move'],
+                          dedup_order=None,
+                          )
+
+    assert ' '.join(sql.split()) == (
+        'insert into game_moves ({columns}) '
+        'select {columns} from temp_game_moves'
+    )
+
+
+def test_get_insert_sql_dedup_order():
+    sql = _get_insert_sql(table_name='position_evals',
+                          temp_table_name='temp_position_evals',
+                          id_cols=['fen'],
+                          dedup_order=['eval_depth desc'],
+                          )
+
+    # the kept row is picked by the order, not whichever postgres sees first
+    assert ' '.join(sql.split()) == (
+        'insert into position_evals ({columns}) '
+        'select distinct on (fen) {columns} from temp_position_evals '
+        'order by fen, eval_depth desc'
+    )
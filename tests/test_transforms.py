@@ -120,14 +120,10 @@ def test_parse_headers_visitor():
 
     headers = transforms.parse_headers(game, visitor)
 
-    materials = [{'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 7, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
+    materials = [[8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 7, 2, 2, 2, 1],
                  ]
 
     assert headers['material_by_move'] == materials
@@ -227,7 +223,7 @@ def test_fix_provisional_columns_full_data():
     pd.testing.assert_frame_equal(parsed, clean, check_like=True)
 
 
-def test_get_sf_evaluation_cloud(mocker, mock_valkey_client):
+def test_get_sf_evaluation_cloud(mocker, eval_budgets):
     mock_parsed_resp = {'pvs': [{'cp': -30}]}
 
     mocker.patch('lichess.api.cloud_eval', return_value=mock_parsed_resp)
@@ -238,7 +234,7 @@ def test_get_sf_evaluation_cloud(mocker, mock_valkey_client):
     rating = transforms.get_sf_evaluation(fen,
                                           '',
                                           1,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == -0.3
@@ -248,24 +244,54 @@ def test_get_sf_evaluation_cloud(mocker, mock_valkey_client):
 def mock_valkey_client():
     class MockValkey:
         def __init__(self):
-            self.counter = 0
+            self.counters = {}
 
-        def get(self, *args, **kwargs):
-            return '0'
+        def incrby(self, key, amount):
+            self.counters[key] = self.counters.get(key, 0) + amount
+            return self.counters[key]
 
-        def incr(self, *args, **kwargs):
-            self.counter += 1
+        def decrby(self, key, amount):
+            return self.incrby(key, -amount)
 
         def expireat(self, *args, **kwargs):
             pass
 
-        def set(self, key, value, exat, nx, keepttl, get, *args, **kwargs):
-            return value
+        def pipeline(self):
+            client = self
+
+            class MockPipeline:
+                def __init__(self):
+                    self.results = []
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *args):
+                    pass
+
+                def __getattr__(self, name):
+                    def queue(*args, **kwargs):
+                        method = getattr(client, name)
+                        self.results.append(method(*args, **kwargs))
+                    return queue
+
+                def execute(self):
+                    return self.results
+
+            return MockPipeline()
 
     return MockValkey()
 
 
-def test_get_sf_evaluation_tracks_api_calls(mocker, mock_valkey_client):
+@pytest.fixture
+def eval_budgets(mock_valkey_client):
+    return transforms.get_eval_budgets(mock_valkey_client)
+
+
+def test_get_sf_evaluation_tracks_api_calls(mocker,
+                                            mock_valkey_client,
+                                            eval_budgets,
+                                            ):
     mock_parsed_resp = {'pvs': [{'cp': -30}]}
 
     mocker.patch('lichess.api.cloud_eval', return_value=mock_parsed_resp)
@@ -276,31 +302,109 @@ def test_get_sf_evaluation_tracks_api_calls(mocker, mock_valkey_client):
     transforms.get_sf_evaluation('',
                                  '',
                                  1,
-                                 valkey_client=mock_valkey_client,
+                                 *eval_budgets,
                                  )
 
-    assert mock_valkey_client.counter == 1
+    # a whole block of calls is reserved, and the unused ones given back
+    api_key = date.today().strftime('lichess-cloud-evals-api-%F')
+    assert mock_valkey_client.counters == {
+        api_key: transforms.LICHESS_CLOUD_EVALS_BLOCK_SIZE,
+    }
+    for budget in eval_budgets:
+        budget.close()
+    assert mock_valkey_client.counters == {api_key: 1}
 
 
-def test_get_sf_evaluation_doesnt_exceed_api_calls(mocker, mock_valkey_client):
+def test_get_sf_evaluation_doesnt_exceed_api_calls(mocker,
+                                                   mock_valkey_client,
+                                                   eval_budgets,
+                                                   ):
     mock_sf = mocker.patch('stockfish.Stockfish')
     mocker.patch('re.search', return_value=None)
     mocker.patch('pipeline_import.transforms._get_terminal_position_rating',
                  return_value=None)
+    mocker.patch('pipeline_import.transforms.get_cfg', side_effect=KeyError)
+    mock_cloud_eval = mocker.patch('lichess.api.cloud_eval')
 
-    mock_valkey_client.counter = MAX_CLOUD_API_CALLS_PER_DAY + 1
+    api_key = date.today().strftime('lichess-cloud-evals-api-%F')
+    mock_valkey_client.counters[api_key] = MAX_CLOUD_API_CALLS_PER_DAY + 1
 
     with pytest.raises(SubprocessError):
         transforms.get_sf_evaluation('',
                                      '',
                                      1,
-                                     valkey_client=mock_valkey_client,
+                                     *eval_budgets,
                                      )
 
+    mock_cloud_eval.assert_not_called()
     mock_sf.assert_called_once()
+    # the calls that were over the limit are given back straight away
+    assert mock_valkey_client.counters[api_key] == (
+        MAX_CLOUD_API_CALLS_PER_DAY + 1
+    )
 
 
-def test_get_sf_evaluation_cloud_mate_in_x(mocker, mock_valkey_client):
+@pytest.fixture
+def mock_remote_eval(mocker):
+    mocker.patch('pipeline_import.transforms.get_cfg',
+                 return_value={'REMOTE_EVAL_URL': 'https://remote.com',
+                               'SCW_AUTH_TOKEN': 'abc',
+                               })
+    session = mocker.patch(
+        'pipeline_import.transforms._get_remote_eval_session',
+    ).return_value
+    session.post.return_value.json.return_value = {
+        'results': ['info depth 20 score cp 30 nodes 1',
+                    'info depth 20 score mate 2 nodes 1',
+                    ],
+    }
+    return session
+
+
+def test_get_remote_evals(mock_remote_eval,
+                          mock_valkey_client,
+                          eval_budgets,
+                          ):
+    fens = ['8/8/8/8/8/8/8/K1k5 w - - 0 0', '8/8/8/8/8/8/8/K1k5 b - - 0 0']
+    _, remote_budget = eval_budgets
+
+    evals = transforms.get_remote_evals(fens, remote_budget)
+    remote_budget.close()
+
+    assert evals == {fens[0]: 0.3, fens[1]: -9999}
+    mock_remote_eval.post.assert_called_once_with(
+        'https://remote.com',
+        headers={'X-Auth-Token': 'abc'},
+        json={'fens': fens},
+    )
+    # the whole batch is a single call to the remote engine
+    remote_key = date.today().strftime('remote-evals-%Y-%m')
+    assert mock_valkey_client.counters[remote_key] == 1
+
+
+def test_get_sf_evaluation_remote(mocker,
+                                  mock_remote_eval,
+                                  eval_budgets,
+                                  ):
+    mocker.patch('pipeline_import.transforms._get_terminal_position_rating',
+                 return_value=None)
+    lichess_budget, remote_budget = eval_budgets
+
+    rating = transforms.get_sf_evaluation('8/8/8/8/8/8/8/K1k5 w - - 0 0',
+                                          '',
+                                          1,
+                                          lichess_budget=None,
+                                          remote_budget=remote_budget,
+                                          )
+
+    assert rating == 0.3
+    # single positions are sent as a batch of one
+    assert mock_remote_eval.post.call_args.kwargs['json'] == {
+        'fens': ['8/8/8/8/8/8/8/K1k5 w - - 0 0'],
+    }
+
+
+def test_get_sf_evaluation_cloud_mate_in_x(mocker, eval_budgets):
     mock_parsed_resp = {'pvs': [{'mate': 1}]}
 
     mocker.patch('lichess.api.cloud_eval', return_value=mock_parsed_resp)
@@ -312,13 +416,13 @@ def test_get_sf_evaluation_cloud_mate_in_x(mocker, mock_valkey_client):
     rating = transforms.get_sf_evaluation(fen,
                                           '',
                                           1,
-                                          valkey_client=mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == 9999
 
 
-def test_get_sf_evaluation_cloud_error(mocker, mock_valkey_client):
+def test_get_sf_evaluation_cloud_error(mocker, eval_budgets):
     mocker.patch('lichess.api.cloud_eval', return_value={'pvs': ['foobar']})
     mocker.patch('pipeline_import.transforms._get_terminal_position_rating',
                  return_value=None)
@@ -326,13 +430,13 @@ def test_get_sf_evaluation_cloud_error(mocker, mock_valkey_client):
         transforms.get_sf_evaluation('fake fen',
                                      '',
                                      1,
-                                     valkey_client=mock_valkey_client,
+                                     *eval_budgets,
                                      )
 
 
 def test_get_sf_evaluation_local_returns_error(mocker,
                                                mocked_cloud_eval,
-                                               mock_valkey_client,
+                                               eval_budgets,
                                                ):
     mocker.patch('stockfish.Stockfish')
     mocker.patch('re.search', return_value=None)
@@ -343,13 +447,13 @@ def test_get_sf_evaluation_local_returns_error(mocker,
         transforms.get_sf_evaluation('',
                                      '',
                                      1,
-                                     mock_valkey_client,
+                                     *eval_budgets,
                                      )
 
 
 def test_get_sf_evaluation_shallow(mock_stockfish,
                                    mocked_cloud_eval,
-                                   mock_valkey_client,
+                                   eval_budgets,
                                    ):
 
     fen = 'r1bq1rk1/1pp3b1/3p2np/nP2P1p1/4Pp2/PN3NP1/1B3PBP/R2Q1RK1 b - - 2 0'
@@ -360,7 +464,7 @@ def test_get_sf_evaluation_shallow(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     if '10' in stockfish_loc:
@@ -375,7 +479,7 @@ def test_get_sf_evaluation_shallow(mock_stockfish,
 
 def test_get_sf_evaluation_deep(mock_stockfish,
                                 mocked_cloud_eval,
-                                mock_valkey_client,
+                                eval_budgets,
                                 ):
 
     fen = 'r1bq1rk1/1pp3b1/3p2np/nP2P1p1/4Pp2/PN3NP1/1B3PBP/R2Q1RK1 b - - 2 0'
@@ -386,7 +490,7 @@ def test_get_sf_evaluation_deep(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     if '10' in stockfish_loc:
@@ -401,7 +505,7 @@ def test_get_sf_evaluation_deep(mock_stockfish,
 
 def test_get_sf_evaluation_checkmate_black(mock_stockfish,
                                            mocked_cloud_eval,
-                                           mock_valkey_client,
+                                           eval_budgets,
                                            ):
 
     fen = '8/5q1k/7p/4Q2r/P3P3/4R1P1/7p/3R1r1K w - - 3 0'
@@ -412,7 +516,7 @@ def test_get_sf_evaluation_checkmate_black(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == -9999
@@ -420,7 +524,7 @@ def test_get_sf_evaluation_checkmate_black(mock_stockfish,
 
 def test_get_sf_evaluation_checkmate_white(mock_stockfish,
                                            mocked_cloud_eval,
-                                           mock_valkey_client,
+                                           eval_budgets,
                                            ):
 
     fen = '5rk1/4Q1b1/8/pp6/8/7N/1P2R1PK/8 w - - 1 0'
@@ -431,7 +535,7 @@ def test_get_sf_evaluation_checkmate_white(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == 9999
@@ -439,7 +543,7 @@ def test_get_sf_evaluation_checkmate_white(mock_stockfish,
 
 def test_get_sf_evaluation_in_stalemate(mock_stockfish,
                                         mocked_cloud_eval,
-                                        mock_valkey_client,
+                                        eval_budgets,
                                         ):
 
     fen = '3Q4/8/8/8/8/3QK2P/8/4k3 b - - 0 56'
@@ -450,7 +554,7 @@ def test_get_sf_evaluation_in_stalemate(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == 0
@@ -458,7 +562,7 @@ def test_get_sf_evaluation_in_stalemate(mock_stockfish,
 
 def test_get_sf_evaluation_in_checkmate(mock_stockfish,
                                         mocked_cloud_eval,
-                                        mock_valkey_client,
+                                        eval_budgets,
                                         ):
 
     fen = '4Rb1k/7Q/8/1p4N1/p7/8/1P4PK/8 b - - 4 0'
@@ -469,7 +573,7 @@ def test_get_sf_evaluation_in_checkmate(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == 9999
@@ -477,7 +581,7 @@ def test_get_sf_evaluation_in_checkmate(mock_stockfish,
 
 def test_get_sf_evaluation_double_checkmate(mock_stockfish,
                                             mocked_cloud_eval,
-                                            mock_valkey_client,
+                                            eval_budgets,
                                             ):
 
     fen = '6k1/4pppp/6r1/3b4/4r3/8/1Q5P/1R5K w - - 0 0'
@@ -488,7 +592,7 @@ def test_get_sf_evaluation_double_checkmate(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == 9999
@@ -498,7 +602,7 @@ def test_get_sf_evaluation_double_checkmate(mock_stockfish,
     rating = transforms.get_sf_evaluation(fen,
                                           stockfish_loc,
                                           depth,
-                                          mock_valkey_client,
+                                          *eval_budgets,
                                           )
 
     assert rating == -9999
@@ -530,6 +634,29 @@ def test_get_clean_fens():
     assert (transforms.get_clean_fens(fen) == clean).all()
 
 
+def test_get_position_hashes():
+    fens = pd.Series(
+        ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0',
+         # same position with a different halfmove clock
+         'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 3',
+         'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0',
+         # exploded game without moves
+         None,
+         ],
+        index=[5, 6, 7, 7],
+    )
+
+    hashes = transforms.get_position_hashes(fens)
+
+    assert hashes.dtype == 'Int64'
+    assert hashes.index.tolist() == [5, 6, 7, 7]
+    assert hashes.isna().tolist() == [False, False, False, True]
+    # unsigned zobrist hash 9384546495678726550 stored as a signed int
+    assert hashes[5] == -9062197578030825066
+    assert hashes[5] == hashes[6]
+    assert hashes[5] != hashes.iloc[2]
+
+
 def test_transform_game_data(tmp_path):
     player = 'thibault'
 
@@ -971,3 +1098,73 @@ def test_get_weekly_data(mocker):
     timedeltas = pd.Timestamp.now() - data['datetime_played']
 
     assert (timedeltas <= pd.Timedelta('7 days')).all()
+
+
+def test_stockfish_pool_reuses_engine(mocker):
+    mock_sf = mocker.patch('stockfish.Stockfish')
+    mock_sf.return_value.info = 'info depth 1 score cp 30'
+
+    fen = 'r1bqkb1r/pp1ppppp/2n2n2/2p5/8/1P3NP1/PBPPPP1P/RN1QKB1R b KQkq - 0 1'
+
+    with transforms.StockfishPool('', 1, size=2) as sf_pool:
+        for _ in range(3):
+            result = transforms._get_local_eval(sf_location='',
+                                                sf_depth=1,
+                                                fen=fen,
+                                                sf_pool=sf_pool,
+                                                )
+            assert result == 'info depth 1 score cp 30'
+
+    mock_sf.assert_called_once()
+    assert mock_sf.return_value.set_fen_position.call_count == 3
+    mock_sf.return_value.stockfish.kill.assert_called_once()
+
+
+def test_stockfish_pool_discards_broken_engine(mocker):
+    mock_sf = mocker.patch('stockfish.Stockfish')
+    mock_sf.return_value.get_best_move.side_effect = [BrokenPipeError, None]
+
+    with transforms.StockfishPool('', 1) as sf_pool:
+        with pytest.raises(BrokenPipeError):
+            transforms._get_local_eval(sf_location='',
+                                       sf_depth=1,
+                                       fen='',
+                                       sf_pool=sf_pool,
+                                       )
+        transforms._get_local_eval(sf_location='',
+                                   sf_depth=1,
+                                   fen='',
+                                   sf_pool=sf_pool,
+                                   )
+
+    assert mock_sf.call_count == 2
+
+
+def test_get_half_moves():
+    lists = pd.Series([['e4', 'e5'], [], None, ['d4', 'd5', 'c4']])
+
+    half_moves = transforms.get_half_moves(lists)
+
+    expected = lists.to_frame('moves').explode('moves')
+    expected['game'] = expected.index
+    assert half_moves.tolist() == [1, 2, 1, 1, 1, 2, 3]
+    assert half_moves.tolist() == (expected.groupby('game').cumcount() + 1
+                                   ).tolist()
+
+
+def test_is_in_half_move_order():
+    game_links = pd.Series(['b', 'b', 'a', 'a', 'a'])
+
+    assert transforms.is_in_half_move_order(game_links,
+                                            pd.Series([1, 2, 1, 2, 3]),
+                                            )
+    assert not transforms.is_in_half_move_order(game_links,
+                                                pd.Series([1, 2, 1, 3, 2]),
+                                                )
+    # game b is split in two runs
+    assert not transforms.is_in_half_move_order(pd.Series(['b', 'a', 'b']),
+                                                pd.Series([1, 1, 1]),
+                                                )
+    assert transforms.is_in_half_move_order(pd.Series([], dtype=str),
+                                            pd.Series([], dtype=int),
+                                            )
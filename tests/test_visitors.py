@@ -1,9 +1,15 @@
 #! /usr/bin/env python3
 
 import io
+import re
+import timeit
+from datetime import datetime
+from pathlib import Path
 
 import chess
+import pytest
 from pipeline_import import visitors
+from pipeline_import.transforms import parse_headers
 
 
 def test_evals_visitor():
@@ -202,14 +208,136 @@ def test_materials_visitor():
 
     game.accept(visitors.MaterialVisitor(game))
 
-    materials = [{'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 8, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
-                 {'p': 7, 'b': 2, 'r': 2, 'q': 1, 'k': 1, 'n': 2,
-                  'P': 8, 'B': 2, 'R': 2, 'Q': 1, 'K': 1, 'N': 2},
+    materials = [[8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 8, 2, 2, 2, 1],
+                 [8, 2, 2, 2, 1, 7, 2, 2, 2, 1],
                  ]
 
     assert game.headers['material_by_move'] == materials
+
+
+@pytest.mark.parametrize('pgn', [
+    # en passant and promotions with and without captures
+    """1. e4 d5 2. e5 f5 3. exf6 g6 4. fxe7 Nf6 5. exf8=Q+ Kxf8 6. h4 c5 7. h5 c4 8. h6 c3 9. hxg7+ Kg8 10. gxh8=N cxb2 11. Nc3 bxa1=R""",  # noqa
+    # chess960 castling is encoded as the king capturing its own rook
+    """[Variant "Chess960"]
+[FEN "bqnb1rkr/pp3ppp/3ppn2/2p5/5P2/P2P4/NPP1P1PP/BQ1BNRKR w HFhf - 2 9"]
+
+9. g3 Bxf3 10. O-O""",
+])
+def test_materials_visitor_matches_board(pgn):
+    game = chess.pgn.read_game(io.StringIO(pgn))
+
+    game.accept(visitors.MaterialVisitor(game))
+
+    expected = [visitors.count_material(game.board())]
+    expected += [visitors.count_material(node.board())
+                 for node in game.mainline()]
+    assert game.headers['material_by_move'] == expected
+
+
+@pytest.mark.parametrize('pgn', [
+    """[Site "https://lichess.org/FCwXJbzX"]
+[Result "1-0"]
+
+1. e4 { [%eval 0.16] [%clk 0:00:30] } 1... e6 { [%eval 0.4] [%clk 0:01:00] } 2. Nf3 { [%eval 0.14] [%clk 0:00:29] } 2... d5 { [%eval 0.2] [%clk 0:01:00] } 3. Bb5+ { [%clk 0:00:28] } 1-0""",  # noqa
+    """[Site "https://lichess.org/TTYLmSUX"]
+
+1. e4 c5 2. f4 d6 3. Nf3 Nf6 4. d3 g6 5. c3 Bg7 6. e5 dxe5 7. fxe5 Nd5 8. d4 cxd4 9. cxd4 O-O 10. Nc3 Nc6 11. Nxd5 Qxd5 12. Be3 Bg4 13. Be2 Bxf3 14. Bxf3 Qa5+ 15. Bd2 Qb5 16. Bc3 Rad8 17. Be2 Qb6 18. d5 Nxe5 19. Bxe5 Bxe5 20. Qd3 Qxb2 21. O-O Qd4+ 22. Kh1 Qxd3 23. Bxd3 1-0""",  # noqa
+    """[Site "https://lichess.org/vepGKt97"]
+
+1. d4 d5 2. Bf4 Bf5 3. c4 e6 4. Nc3 c6 5. Qb3 Qb6 6. Qxb6 axb6 7. Nf3 Nd7 8. e3 Ngf6 9. cxd5 exd5 10. h3 Be7 11. g4 Bg6 12. g5 Ne4 13. Nxe4 Bxe4 14. Bg2 O-O 15. h4 Ra4 16. O-O Rfa8 17. a3 b5 18. Ne5 Nxe5 19. Bxe5 Bxg2 20. Kxg2 b4 21. Bc7 bxa3 22. bxa3 Rxa3 23. Rxa3 Rxa3 24. Rb1 b5 25. Bb6 Ra6 26. Bc5 Bxc5 27. dxc5 Kf8 28. Kf3 Ra4 29. Kg3 Ke7 30. f4 Ke6 31. Kf3 Kf5 32. Rd1 Rc4 33. h5 Rxc5 34. Rd4 Rc4 35. e4+ dxe4+ 36. Ke3 Rxd4 37. Kxd4 b4 38. Kc5 e3 39. Kxb4 e2 40. Kc5 e1=Q 41. Kxc6 Qe4+ 42. Kd7 Qxf4 43. h6 gxh6 44. Ke7 Qxg5+ 45. Kf8 h5 46. Kxf7 h4 47. Kf8 h3 48. Kf7 h2 49. Kf8 h1=Q 50. Ke8 Qb7 51. Kf8 Qgg7+ 52. Ke8 Qg8# 0-1""",  # noqa
+    """[Site "https://lichess.org/oUMAQzs2"]
+
+1. d4 { [%clk 0:01:00] } 1... Nf6 { [%clk 0:01:00] } 2. c4 (2. Nf3 { [%clk 0:00:59] } 2... g6) 2... c5 { [%clk 0:00:59] } 3. d5 { [%clk 0:00:58] } 1-0""",  # noqa
+])
+def test_game_visitor_matches_separate_visitors(pgn):
+    separate_visitors = [visitors.EvalsVisitor,
+                         visitors.ClocksVisitor,
+                         visitors.QueenExchangeVisitor,
+                         visitors.CastlingVisitor,
+                         visitors.PromotionsVisitor,
+                         visitors.PositionsVisitor,
+                         visitors.MaterialVisitor,
+                         ]
+
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    expected = parse_headers(game, separate_visitors)
+
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    actual = parse_headers(game, [visitors.GameVisitor])
+
+    # same keys in the same order, so the dataframe columns match too
+    assert list(actual.items()) == list(expected.items())
+
+
+def test_parse_comment():
+    assert visitors.parse_comment('[%eval 0.16] [%clk 0:01:00]') == ('0.16',
+                                                                     '0:01:00')
+    assert visitors.parse_comment('[%clk 0:00:59] [%eval #-3]') == ('#-3',
+                                                                    '0:00:59')
+    assert visitors.parse_comment('[%clk 0:00:59]') == (None, '0:00:59')
+    assert visitors.parse_comment('[%eval -1.5]') == ('-1.5', None)
+    assert visitors.parse_comment('Black wins by checkmate.') == (None, None)
+
+
+def test_clock_to_seconds():
+    assert visitors.clock_to_seconds('0:00:00') == 0
+    assert visitors.clock_to_seconds('0:01:39') == 99
+    assert visitors.clock_to_seconds('1:30:05') == 5405
+
+    with pytest.raises(ValueError):
+        visitors.clock_to_seconds('')
+
+
+def _get_corpus_comments() -> list[str]:
+    corpus = Path(__file__).parent / 'data' / 'lichess_games.pgn'
+
+    comments: list[str] = []
+    with open(corpus) as f:
+        while (game := chess.pgn.read_game(f)) is not None:
+            comments.extend(node.comment for node in game.mainline())
+    return comments
+
+
+def _parse_with_searches(comment: str) -> tuple[str | None, str | None]:
+    evaluation = re.search(r'\[%eval ([^\]]+)', comment)
+    clock = re.search(r'\[%clk ([^\]]+)', comment)
+    return (evaluation and evaluation.group(1), clock and clock.group(1))
+
+
+def test_parse_comment_matches_searches():
+    comments = _get_corpus_comments()
+    assert any(visitors.parse_comment(comment)[1] for comment in comments)
+
+    for comment in comments:
+        evaluation, clock = visitors.parse_comment(comment)
+
+        assert (evaluation, clock) == _parse_with_searches(comment)
+        if clock is not None:
+            parsed = datetime.strptime(clock, '%H:%M:%S')
+            expected = (parsed - datetime(1900, 1, 1)).total_seconds()
+            assert visitors.clock_to_seconds(clock) == expected
+
+
+@pytest.mark.benchmark
+def test_parse_comment_benchmark():
+    comments = _get_corpus_comments()
+
+    def parse_with_searches():
+        for comment in comments:
+            _, clock = _parse_with_searches(comment)
+            if clock is not None:
+                datetime.strptime(clock, '%H:%M:%S')
+
+    def parse_with_single_scan():
+        for comment in comments:
+            _, clock = visitors.parse_comment(comment)
+            if clock is not None:
+                visitors.clock_to_seconds(clock)
+
+    old = min(timeit.repeat(parse_with_searches, repeat=5, number=20))
+    new = min(timeit.repeat(parse_with_single_scan, repeat=5, number=20))
+
+    assert new < old
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+from utils.eval_cache import EVAL_COLUMNS, EvalCache
+
+
+@pytest.fixture
+def mock_valkey_client():
+    class MockValkey:
+        def __init__(self):
+            self.hashes = {}
+            self.sorted_sets = {}
+
+        def hmget(self, name, keys):
+            return [self.hashes.get(name, {}).get(key) for key in keys]
+
+        def hset(self, name, mapping):
+            self.hashes.setdefault(name, {}).update(mapping)
+
+        def hdel(self, name, *keys):
+            for key in keys:
+                self.hashes[name].pop(key)
+
+        def zadd(self, name, mapping):
+            self.sorted_sets.setdefault(name, {}).update(mapping)
+
+        def zcard(self, name):
+            return len(self.sorted_sets[name])
+
+        def zpopmin(self, name, count):
+            members = sorted(self.sorted_sets[name].items(),
+                             key=lambda x: x[1],
+                             )[:count]
+            for member, _ in members:
+                self.sorted_sets[name].pop(member)
+            return members
+
+        def pipeline(self):
+            client = self
+
+            class MockPipeline:
+                def __init__(self):
+                    self.results = []
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *args):
+                    pass
+
+                def __getattr__(self, name):
+                    def queue(*args, **kwargs):
+                        method = getattr(client, name)
+                        self.results.append(method(*args, **kwargs))
+                    return queue
+
+                def execute(self):
+                    return self.results
+
+            return MockPipeline()
+
+    return MockValkey()
+
+
+def test_eval_cache_roundtrip(mock_valkey_client):
+    cache = EvalCache(valkey_client=mock_valkey_client, max_size=10)
+
+    evals = pd.DataFrame([['fen a', 0.3, 20], ['fen b', -9999.0, 1]],
+                         columns=EVAL_COLUMNS)
+    cache.set_many(evals)
+
+    actual = cache.get_many(['fen b', 'fen c', 'fen a'])
+
+    expected = pd.DataFrame([['fen b', -9999.0, 1], ['fen a', 0.3, 20]],
+                            columns=EVAL_COLUMNS)
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_eval_cache_skips_shallow_evals(mock_valkey_client):
+    cache = EvalCache(valkey_client=mock_valkey_client, max_size=10)
+
+    evals = pd.DataFrame([['fen a', 0.3, 20], ['fen b', 0.1, 8]],
+                         columns=EVAL_COLUMNS)
+    cache.set_many(evals)
+
+    actual = cache.get_many(['fen a', 'fen b'], min_depth=20)
+
+    # the shallow eval isn't served, so it gets evaluated at depth 20
+    assert actual['fen'].tolist() == ['fen a']
+    shallow = cache.get_many(['fen b'], min_depth=8)
+    assert shallow['eval_depth'].tolist() == [8]
+
+
+def test_eval_cache_evicts_least_recently_used(mocker, mock_valkey_client):
+    mock_time = mocker.patch('utils.eval_cache.time.time', return_value=1)
+    cache = EvalCache(valkey_client=mock_valkey_client, max_size=2)
+
+    cache.set_many(pd.DataFrame([['fen a', 0.1, 20], ['fen b', 0.2, 20]],
+                                columns=EVAL_COLUMNS))
+
+    # reading fen a makes fen b the least recently used
+    mock_time.return_value = 2
+    cache.get_many(['fen a'])
+
+    mock_time.return_value = 3
+    cache.set_many(pd.DataFrame([['fen c', 0.3, 20]], columns=EVAL_COLUMNS))
+
+    actual = cache.get_many(['fen a', 'fen b', 'fen c'])
+
+    assert actual['fen'].tolist() == ['fen a', 'fen c']
+
+
+def test_eval_cache_empty_lookup(mock_valkey_client):
+    cache = EvalCache(valkey_client=mock_valkey_client, max_size=10)
+
+    assert cache.get_many([]).empty
+    assert cache.get_many(['fen a']).empty
@@ -0,0 +1,75 @@
+import pandas as pd
+from utils.output import (
+    get_step_row_count,
+    iter_step_batches,
+    keep_outputs_in_memory,
+    read_step_input,
+    write_step_output,
+)
+
+
+def test_read_step_input_projects_columns(tmp_path, capsys):
+    df = pd.DataFrame({'game_link': ['a', 'b'],
+                       'moves': [['e4', 'e5'], ['d4']],
+                       'result': ['1-0', '0-1'],
+                       })
+    df = df.explode('moves')
+    df.to_parquet(tmp_path / 'df.parquet')
+
+    read = read_step_input(tmp_path / 'df.parquet',
+                           columns=['game_link', 'result', 'missing'],
+                           )
+
+    pd.testing.assert_frame_equal(read, df[['game_link', 'result']])
+    out: str = capsys.readouterr().out
+    assert '(2 of 3 columns) from df.parquet' in out
+
+
+def test_read_step_input_exclude(tmp_path):
+    df = pd.DataFrame({'game_link': ['a'],
+                       'moves': [['e4', 'e5']],
+                       'result': ['1-0'],
+                       })
+    df.to_parquet(tmp_path / 'df.parquet')
+
+    read = read_step_input(tmp_path / 'df.parquet', exclude=['moves'])
+
+    pd.testing.assert_frame_equal(read, df[['game_link', 'result']])
+
+
+def test_read_step_input_empty(tmp_path):
+    pd.DataFrame().to_parquet(tmp_path / 'df.parquet')
+
+    read = read_step_input(tmp_path / 'df.parquet', columns=['game_link'])
+
+    assert read.empty
+
+
+def test_keep_outputs_in_memory(tmp_path):
+    df = pd.DataFrame({'game_link': pd.Categorical(['a', 'a', 'b']),
+                       'move': ['e4', 'e5', 'd4'],
+                       'half_move': [1, 2, 1],
+                       })
+    moves_path = tmp_path / 'test_exploded_moves.parquet'
+    evals_path = tmp_path / 'test_evals.parquet'
+
+    with keep_outputs_in_memory(checkpoints=['evals']):
+        write_step_output(df, moves_path)
+        write_step_output(df, evals_path)
+
+        # only checkpoints are written to disk
+        assert not moves_path.exists()
+        assert evals_path.exists()
+
+        read = read_step_input(moves_path, columns=['game_link', 'move'])
+        pd.testing.assert_frame_equal(read, df[['game_link', 'move']])
+        assert get_step_row_count(moves_path) == 3
+        batches = list(iter_step_batches(moves_path, ['move']))
+        assert [batch.to_pydict() for batch in batches] == [
+            {'move': ['e4', 'e5', 'd4']},
+        ]
+
+    # outside of the context, outputs go to disk again
+    write_step_output(df, moves_path)
+    assert moves_path.exists()
+    assert get_step_row_count(moves_path) == 3
@@ -0,0 +1,102 @@
+from datetime import date
+
+import pytest
+from utils.rate_budget import RateBudget
+
+
+@pytest.fixture
+def mock_valkey_client():
+    class MockValkey:
+        def __init__(self):
+            self.counters = {}
+            self.expirations = {}
+            self.calls = 0
+
+        def incrby(self, key, amount):
+            self.calls += 1
+            self.counters[key] = self.counters.get(key, 0) + amount
+            return self.counters[key]
+
+        def decrby(self, key, amount):
+            return self.incrby(key, -amount)
+
+        def expireat(self, key, when, nx):
+            self.expirations.setdefault(key, when)
+
+        def pipeline(self):
+            client = self
+
+            class MockPipeline:
+                def __init__(self):
+                    self.results = []
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *args):
+                    pass
+
+                def __getattr__(self, name):
+                    def queue(*args, **kwargs):
+                        method = getattr(client, name)
+                        self.results.append(method(*args, **kwargs))
+                    return queue
+
+                def execute(self):
+                    return self.results
+
+            return MockPipeline()
+
+    return MockValkey()
+
+
+def test_rate_budget_reserves_blocks(mock_valkey_client):
+    key = date.today().strftime('api-%F')
+
+    with RateBudget(valkey_client=mock_valkey_client,
+                    key_format='api-%F',
+                    limit=100,
+                    period='day',
+                    block_size=10,
+                    ) as budget:
+        assert all(budget.acquire() for _ in range(15))
+        # two blocks were reserved, with one round trip each
+        assert mock_valkey_client.counters == {key: 20}
+        assert mock_valkey_client.calls == 2
+
+    # the 5 unused tokens were given back
+    assert mock_valkey_client.counters == {key: 15}
+    expiration = mock_valkey_client.expirations[key]
+    assert expiration.date() > date.today()
+
+
+def test_rate_budget_shared_limit(mock_valkey_client):
+    budgets = [RateBudget(valkey_client=mock_valkey_client,
+                          key_format='api-%Y-%m',
+                          limit=25,
+                          period='month',
+                          block_size=10,
+                          )
+               for _ in range(2)]
+
+    acquired = 0
+    while any(budget.acquire() for budget in budgets):
+        acquired += 1
+
+    # the workers never use more than the limit between them
+    assert acquired == 25
+    key = date.today().strftime('api-%Y-%m')
+    assert mock_valkey_client.counters == {key: 25}
+    # and stop asking for more once it was reached
+    calls = mock_valkey_client.calls
+    assert not any(budget.acquire() for budget in budgets)
+    assert mock_valkey_client.calls == calls
+
+
+def test_rate_budget_invalid_period(mock_valkey_client):
+    with pytest.raises(ValueError):
+        RateBudget(valkey_client=mock_valkey_client,
+                   key_format='api-%Y',
+                   limit=10,
+                   period='year',
+                   )
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+import requests
+from vendors import lichess_cloud_evals
+from vendors.lichess_cloud_evals import get_cloud_evals
+
+
+class MockBudget:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.threads = set()
+
+    def acquire(self):
+        self.threads.add(threading.current_thread())
+        if not self.tokens:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class MockResponse:
+    def __init__(self, status_code, json=None):
+        self.status_code = status_code
+        self._json = json
+
+    def json(self):
+        return self._json
+
+
+@pytest.fixture
+def mock_session_get(mocker):
+    return mocker.patch.object(requests.Session, 'get')
+
+
+def test_get_cloud_evals(mock_session_get):
+    responses = {'a': MockResponse(200, {'pvs': [{'cp': 30}]}),
+                 'b': MockResponse(404),
+                 'c': MockResponse(200, {'pvs': [{'mate': -2}]}),
+                 }
+    mock_session_get.side_effect = (
+        lambda url, params, timeout: responses[params['fen']]
+    )
+    budget = MockBudget(10)
+
+    evals = get_cloud_evals(['a', 'b', 'c'], budget)
+
+    # positions without a cloud eval are left out
+    assert evals == {'a': 0.3, 'c': -9999}
+    assert budget.tokens == 7
+    # the budget can make a round trip to valkey, so it's kept off the loop
+    assert threading.main_thread() not in budget.threads
+
+
+def test_get_cloud_evals_within_budget(mock_session_get):
+    mock_session_get.return_value = MockResponse(200, {'pvs': [{'cp': 0}]})
+
+    evals = get_cloud_evals(['a', 'b', 'c'], MockBudget(2))
+
+    assert len(evals) == 2
+    assert mock_session_get.call_count == 2
+
+
+def test_get_cloud_evals_concurrently(mock_session_get):
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def get(url, params, timeout):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return MockResponse(200, {'pvs': [{'cp': 10}]})
+
+    mock_session_get.side_effect = get
+    fens = [str(idx) for idx in range(12)]
+
+    evals = get_cloud_evals(fens, MockBudget(100), max_in_flight=3)
+
+    assert evals == dict.fromkeys(fens, 0.1)
+    assert max_in_flight == 3
+
+
+def test_get_cloud_evals_backs_off_globally(mocker, mock_session_get):
+    mocker.patch.object(lichess_cloud_evals,
+                        'RATE_LIMIT_BACKOFF_SECONDS',
+                        0.2,
+                        )
+    request_times = {}
+
+    def get(url, params, timeout):
+        fen = params['fen']
+        request_times.setdefault(fen, []).append(time.monotonic())
+        if fen == 'a' and len(request_times[fen]) == 1:
+            return MockResponse(429)
+        # give the rate limited request time to pause the others
+        time.sleep(0.05)
+        return MockResponse(200, {'pvs': [{'cp': 10}]})
+
+    mock_session_get.side_effect = get
+    budget = MockBudget(100)
+
+    evals = get_cloud_evals(['a', 'b', 'c', 'd'], budget, max_in_flight=2)
+
+    assert evals == dict.fromkeys('abcd', 0.1)
+    # the retry counts against the budget too
+    assert budget.tokens == 95
+    # requests started after the 429 waited for the backoff
+    rate_limited_at = request_times['a'][0]
+    retried_at = request_times['a'][1]
+    assert retried_at - rate_limited_at >= 0.2
+    assert all(times[0] - rate_limited_at >= 0.2
+               for fen, times in request_times.items()
+               if fen in 'cd')
+
+
+def test_get_cloud_evals_stops_when_still_rate_limited(mocker,
+                                                       mock_session_get,
+                                                       ):
+    mocker.patch.object(lichess_cloud_evals, 'RATE_LIMIT_BACKOFF_SECONDS', 0)
+    mock_session_get.return_value = MockResponse(429)
+    budget = MockBudget(100)
+
+    evals = get_cloud_evals(['a', 'b', 'c', 'd'], budget, max_in_flight=1)
+
+    assert evals == {}
+    # the first position is retried once after the backoff, and the others
+    # are given up on without spending any calls
+    assert mock_session_get.call_count == 2
+    assert budget.tokens == 98
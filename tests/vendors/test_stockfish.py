@@ -2,8 +2,13 @@ from datetime import date
 
 import pandas as pd
 import pytest
+from pipeline_import.transforms import get_position_hashes
 from utils.output import get_output_file_prefix
-from vendors.stockfish import get_evals
+from vendors.stockfish import (
+    _get_positions_to_evaluate,
+    get_db_evaluations,
+    get_evals,
+)
 
 
 @pytest.fixture
@@ -19,6 +24,16 @@ def mock_stockfish_cfg(mocker):
                  return_value={'location': 'abc', 'depth': 1})
 
 
+@pytest.fixture
+def mock_cloud_evals(mocker):
+    return mocker.patch('vendors.stockfish.get_cloud_evals', return_value={})
+
+
+@pytest.fixture
+def mock_remote_evals(mocker):
+    return mocker.patch('vendors.stockfish.get_remote_evals', return_value={})
+
+
 @pytest.fixture
 def mock_stockfish(mocker):
     mocker.patch('vendors.stockfish.get_sf_evaluation', return_value=-9999)
@@ -30,6 +45,8 @@ def test_get_evals_on_checkmate_position(mocker,
                                          mock_stockfish,
                                          mock_stockfish_cfg,
                                          mock_run_remote_sql_query,
+                                         mock_cloud_evals,
+                                         mock_remote_evals,
                                          mocked_cloud_eval,
                                          ):
     # TODO: what is this test checking, exactly?
@@ -56,5 +73,349 @@ def test_get_evals_on_checkmate_position(mocker,
 
     expected = pd.DataFrame([[fen[:-2], -9999, 1]],
                             columns=['fen', 'evaluation', 'eval_depth'])
+    expected['fen_hash'] = get_position_hashes(expected['fen'])
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_get_evals_parallel_keeps_order(mocker,
+                                        monkeypatch,
+                                        tmp_path,
+                                        mock_stockfish_cfg,
+                                        mock_run_remote_sql_query,
+                                        mock_cloud_evals,
+                                        mock_remote_evals,
+                                        ):
+    mocker.patch('vendors.stockfish.valkey')
+    monkeypatch.setenv('VALKEY_CONNECTION_URL', '')
+
+    fens = ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+            'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+            'rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2',
+            ]
+    fake_evals = {fen[:-2]: idx / 10 for idx, fen in enumerate(fens)}
+    mocker.patch('vendors.stockfish.get_sf_evaluation',
+                 side_effect=lambda fen, *args, **kwargs: fake_evals[fen[:-2]],
+                 )
+
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+
+    df = pd.DataFrame([[[], [], fens]],
+                      columns=['evaluations', 'eval_depths', 'positions'],
+                      )
+    df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    get_evals(player='test',
+              perf_type='bullet',
+              data_date=date(2025, 1, 1),
+              local_stockfish=True,
+              io_dir=tmp_path,
+              eval_workers=3,
+              )
+    actual = pd.read_parquet(tmp_path / f'{prefix}_evals.parquet')
+
+    expected = pd.DataFrame([[fen[:-2], fake_evals[fen[:-2]], 1]
+                             for fen in fens],
+                            columns=['fen', 'evaluation', 'eval_depth'])
+    expected['fen_hash'] = get_position_hashes(expected['fen'])
 
     pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_get_evals_keeps_shared_pool_open(mocker,
+                                          monkeypatch,
+                                          tmp_path,
+                                          mock_stockfish,
+                                          mock_stockfish_cfg,
+                                          mock_run_remote_sql_query,
+                                          mock_cloud_evals,
+                                          mock_remote_evals,
+                                          ):
+    mocker.patch('vendors.stockfish.valkey')
+    monkeypatch.setenv('VALKEY_CONNECTION_URL', '')
+    fen = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+    df = pd.DataFrame([[[], [], [fen]]],
+                      columns=['evaluations', 'eval_depths', 'positions'],
+                      )
+    df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    sf_pool = mocker.MagicMock()
+
+    get_evals(player='test',
+              perf_type='bullet',
+              data_date=date(2025, 1, 1),
+              local_stockfish=True,
+              io_dir=tmp_path,
+              sf_pool=sf_pool,
+              )
+
+    # the caller owns the pool, so it is reused rather than closed
+    sf_pool.__exit__.assert_not_called()
+    sf_pool.close.assert_not_called()
+
+
+def test_get_evals_deduplicates_positions(mocker,
+                                          monkeypatch,
+                                          tmp_path,
+                                          mock_stockfish_cfg,
+                                          mock_run_remote_sql_query,
+                                          mock_cloud_evals,
+                                          mock_remote_evals,
+                                          ):
+    mocker.patch('vendors.stockfish.valkey')
+    monkeypatch.setenv('VALKEY_CONNECTION_URL', '')
+    mock_sf_eval = mocker.patch('vendors.stockfish.get_sf_evaluation',
+                                return_value=0.3,
+                                )
+
+    fen = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+
+    # two games sharing the same first move
+    df = pd.DataFrame([[[], [], [fen]], [[], [], [fen]]],
+                      columns=['evaluations', 'eval_depths', 'positions'],
+                      )
+    df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    get_evals(player='test',
+              perf_type='bullet',
+              data_date=date(2025, 1, 1),
+              local_stockfish=True,
+              io_dir=tmp_path,
+              )
+    actual = pd.read_parquet(tmp_path / f'{prefix}_evals.parquet')
+
+    expected = pd.DataFrame([[fen[:-2], 0.3, 1]],
+                            columns=['fen', 'evaluation', 'eval_depth'])
+    expected['fen_hash'] = get_position_hashes(expected['fen'])
+
+    pd.testing.assert_frame_equal(actual, expected)
+    mock_sf_eval.assert_called_once()
+
+
+def test_get_evals_uses_bulk_evals_first(mocker,
+                                         monkeypatch,
+                                         tmp_path,
+                                         mock_stockfish_cfg,
+                                         mock_run_remote_sql_query,
+                                         mock_cloud_evals,
+                                         mock_remote_evals,
+                                         ):
+    mocker.patch('vendors.stockfish.valkey')
+    monkeypatch.setenv('VALKEY_CONNECTION_URL', '')
+    mocker.patch('vendors.stockfish.REMOTE_EVAL_BATCH_SIZE', 1)
+    mock_sf_eval = mocker.patch('vendors.stockfish.get_sf_evaluation',
+                                return_value=0.3,
+                                )
+
+    fens = ['rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1',
+            'rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2',
+            'rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2',
+            'rnbqkbnr/pp2pppp/3p4/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 0 3',
+            ]
+    # positions are looked up with a full move number of 0
+    lookup_fens = [fen[:-2] + ' 0' for fen in fens]
+    mock_cloud_evals.return_value = {lookup_fens[0]: -0.1}
+    remote_evals = {lookup_fens[1]: 0.2, lookup_fens[2]: 0.25}
+    mock_remote_evals.side_effect = (
+        lambda batch, remote_budget: {fen: remote_evals[fen]
+                                      for fen in batch
+                                      if fen in remote_evals}
+    )
+
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+
+    df = pd.DataFrame([[[], [], fens]],
+                      columns=['evaluations', 'eval_depths', 'positions'],
+                      )
+    df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    get_evals(player='test',
+              perf_type='bullet',
+              data_date=date(2025, 1, 1),
+              local_stockfish=True,
+              io_dir=tmp_path,
+              )
+    actual = pd.read_parquet(tmp_path / f'{prefix}_evals.parquet')
+
+    expected = pd.DataFrame([[fens[0][:-2], -0.1, 1],
+                             [fens[1][:-2], 0.2, 1],
+                             [fens[2][:-2], 0.25, 1],
+                             [fens[3][:-2], 0.3, 1],
+                             ],
+                            columns=['fen', 'evaluation', 'eval_depth'])
+    expected['fen_hash'] = get_position_hashes(expected['fen'])
+
+    pd.testing.assert_frame_equal(actual, expected)
+    assert mock_cloud_evals.call_args.args[0] == lookup_fens
+    # positions without a cloud eval are sent to the remote engine in
+    # batches, sharing a budget
+    assert [call.args[0] for call in mock_remote_evals.call_args_list] == [
+        [fen] for fen in lookup_fens[1:]
+    ]
+    assert len({id(call.kwargs['remote_budget'])
+                for call in mock_remote_evals.call_args_list}) == 1
+    # only the last position is evaluated locally, without trying the
+    # cloud or the remote engine again
+    mock_sf_eval.assert_called_once()
+    assert mock_sf_eval.call_args.args[0] == lookup_fens[3]
+    assert mock_sf_eval.call_args.kwargs['lichess_budget'] is None
+    assert mock_sf_eval.call_args.kwargs['remote_budget'] is None
+
+
+def test_get_positions_to_evaluate():
+    positions = pd.Series(['a', 'b', 'a', 'c', 'd', 'b'])
+
+    actual = _get_positions_to_evaluate(positions, {'c', 'x'})
+
+    assert actual == ['a', 'b', 'd']
+
+
+def test_get_positions_to_evaluate_scales_with_db_hits():
+    class CountingSet(set):
+        lookups = 0
+        scans = 0
+
+        def __contains__(self, item):
+            CountingSet.lookups += 1
+            return super().__contains__(item)
+
+        def __iter__(self):
+            CountingSet.scans += 1
+            return super().__iter__()
+
+    positions = pd.Series([f'position {idx % 500}' for idx in range(1000)])
+    positions_evaluated = CountingSet(f'position {idx}'
+                                      for idx in range(0, 50_000, 2))
+
+    actual = _get_positions_to_evaluate(positions, positions_evaluated)
+
+    assert actual == [f'position {idx}' for idx in range(1, 500, 2)]
+    # one lookup per unique position, without ever scanning the db hits
+    assert CountingSet.lookups == 500
+    assert CountingSet.scans == 0
+
+
+def test_get_evals_uses_eval_cache(mocker, monkeypatch, tmp_path):
+    mocker.patch('vendors.stockfish.valkey')
+    monkeypatch.setenv('VALKEY_CONNECTION_URL', '')
+    mocker.patch('vendors.stockfish.get_cfg',
+                 return_value={'location': 'abc', 'depth': 1, 'cache_size': 5})
+    mock_sql = mocker.patch('vendors.stockfish.run_remote_sql_query')
+    mock_sf_eval = mocker.patch('vendors.stockfish.get_sf_evaluation')
+
+    fen = 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1'
+    cached = pd.DataFrame([[fen[:-2], 0.3, 20]],
+                          columns=['fen', 'evaluation', 'eval_depth'])
+    mock_cache = mocker.patch('vendors.stockfish.EvalCache')
+    mock_cache.return_value.get_many.return_value = cached
+
+    prefix: str = get_output_file_prefix(player='test',
+                                         perf_type='bullet',
+                                         data_date=date(2025, 1, 1),
+                                         )
+
+    df = pd.DataFrame([[[], [], [fen]]],
+                      columns=['evaluations', 'eval_depths', 'positions'],
+                      )
+    df.to_parquet(tmp_path / f'{prefix}_cleaned_df.parquet')
+    get_evals(player='test',
+              perf_type='bullet',
+              data_date=date(2025, 1, 1),
+              local_stockfish=True,
+              io_dir=tmp_path,
+              )
+    actual = pd.read_parquet(tmp_path / f'{prefix}_evals.parquet')
+
+    expected = cached.copy()
+    expected['fen_hash'] = get_position_hashes(expected['fen'])
+
+    pd.testing.assert_frame_equal(actual, expected)
+    mock_sql.assert_not_called()
+    mock_sf_eval.assert_not_called()
+    mock_cache.return_value.set_many.assert_called_once()
+    get_many = mock_cache.return_value.get_many
+    assert get_many.call_args.kwargs['min_depth'] == 1
+
+
+@pytest.mark.parametrize('position_count,strategy,query_count',
+                         [(3, None, 1),
+                          (10, 'chunked', 4),
+                          ])
+def test_get_db_evaluations_strategies(mocker,
+                                       monkeypatch,
+                                       position_count,
+                                       strategy,
+                                       query_count,
+                                       ):
+    monkeypatch.setattr('vendors.stockfish.ANY_LOOKUP_MAX_POSITIONS', 5)
+    monkeypatch.setattr('vendors.stockfish.DB_LOOKUP_CHUNK_SIZE', 3)
+    mock_sql = mocker.patch(
+        'vendors.stockfish.run_remote_sql_query',
+        side_effect=lambda sql, positions: pd.DataFrame(
+            [[fen, 0.1, 20] for fen in positions],
+            columns=['fen', 'evaluation', 'eval_depth'],
+        ),
+    )
+
+    positions = [f'fen {idx}' for idx in range(position_count)]
+
+    # duplicates are only looked up once
+    actual = get_db_evaluations(positions + positions, strategy=strategy)
+
+    assert actual['fen'].tolist() == positions
+    assert mock_sql.call_count == query_count
+    assert all('ANY' in call.args[0] for call in mock_sql.call_args_list)
+
+
+def test_get_db_evaluations_temp_table(mocker):
+    mock_sql = mocker.patch('vendors.stockfish.run_remote_sql_query')
+    mock_temp_table_sql = mocker.patch(
+        'vendors.stockfish.run_remote_sql_query_with_table',
+        return_value=pd.DataFrame([['fen a', 0.1, 20]],
+                                  columns=['fen', 'evaluation', 'eval_depth']),
+    )
+
+    actual = get_db_evaluations(['fen a', 'fen b'], strategy='temp_table')
+
+    assert actual['fen'].tolist() == ['fen a']
+    mock_sql.assert_not_called()
+    table = mock_temp_table_sql.call_args.kwargs['table']
+    assert table.column('fen').to_pylist() == ['fen a', 'fen b']
+    # adbc wraps the query in a COPY, which fails on a trailing semicolon
+    sql = mock_temp_table_sql.call_args.args[0]
+    assert not sql.rstrip().endswith(';')
+
+
+def test_get_db_evaluations_temp_table_for_many_positions(mocker,
+                                                          monkeypatch,
+                                                          ):
+    monkeypatch.setattr('vendors.stockfish.ANY_LOOKUP_MAX_POSITIONS', 1)
+    mock_sql = mocker.patch('vendors.stockfish.run_remote_sql_query')
+    mock_temp_table_sql = mocker.patch(
+        'vendors.stockfish.run_remote_sql_query_with_table',
+        return_value=pd.DataFrame([], columns=['fen',
+                                               'evaluation',
+                                               'eval_depth',
+                                               ]),
+    )
+
+    get_db_evaluations(['fen a', 'fen b'])
+
+    mock_sql.assert_not_called()
+    mock_temp_table_sql.assert_called_once()
+
+
+def test_get_db_evaluations_unknown_strategy():
+    with pytest.raises(ValueError):
+        get_db_evaluations(['fen a'], strategy='foobar')